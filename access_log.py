@@ -0,0 +1,180 @@
+# lokitus
+#
+# print() kirjoittaa suoraan stdoutiin, ja kun monta säiettä kutsuu sitä yhtä aikaa,
+# ne joutuvat odottamaan toisiaan. siksi lokirivit laitetaan jonoon (queue),
+# josta erillinen taustasäie kirjoittaa ne useamman rivin erissä
+#
+# jono on rajattu (QUEUE_SIZE): jos lokia ei ehditä kirjoittaa (esim. hidas levy tai stdout-putki,
+# jota kukaan ei lue), uudet rivit pudotetaan eikä muistinkäyttö kasva. pudotettujen rivien määrä
+# näkyy mittarina log_records_dropped_total (ks. metrics.py)
+#
+# tasot (level): DEBUG < INFO < WARNING < ERROR
+# oletuksena DEBUG-tason viestejä (esim. "Client connected") ei kirjoiteta ollenkaan
+#
+# access-lokin muodot:
+#   common: 127.0.0.1 - - [18/Oct/2026:12:00:00 +0000] "GET /users HTTP/1.1" 200 49 0.0012
+#   json:   {"time": "...", "remote": "127.0.0.1", "method": "GET", "path": "/users", ...}
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+_LEVEL_NAMES = {value: name.upper() for name, value in LEVELS.items()}
+
+# kuinka monta riviä kirjoitetaan kerralla
+BATCH_SIZE = 256
+# kuinka monta riviä jonossa voi olla odottamassa
+QUEUE_SIZE = 65536
+
+_ACCESS = 0
+
+
+class AccessLog:
+    def __init__(self, stream=None, level=INFO, fmt="common", batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.level = level
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # täyden jonon takia pudotetut rivit
+        self.dropped = 0
+        self._start()
+
+    def _start(self):
+        # lukko luodaan uudestaan myös forkin jälkeen, koska jokin toinen säie on voinut pitää sitä
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # otetaan jonosta kerralla kaikki odottavat rivit (enintään batch_size)
+            # ja kirjoitetaan ne yhdellä write()-kutsulla
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self.stream.write("".join(self._format_safe(record) for record in batch))
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+            if stop:
+                return
+
+    def _format_safe(self, record):
+        # virheellinen rivi (esim. log.info("%d", "x")) ei saa pysäyttää taustasäiettä,
+        # koska silloin kaikki myöhemmät lokirivit katoaisivat
+        try:
+            return self._format(record)
+        except Exception:
+            level, timestamp, fields = record
+            if level == _ACCESS:
+                return f"{fields!r}\n"
+            # kirjoitetaan viesti muotoilematta ja argumentit sen perään
+            message, args = fields
+            return self._format((level, timestamp, (f"{message} {args!r}", ())))
+
+    def _format(self, record):
+        level, timestamp, fields = record
+        if level == _ACCESS:
+            remote, method, path, version, status, size, duration = fields
+            if self.fmt == "json":
+                return json.dumps({
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp)),
+                    "remote": remote, "method": method, "path": path, "version": version,
+                    "status": status, "bytes": size, "duration_ms": round(duration * 1000, 3),
+                }) + "\n"
+            return (f'{remote} - - [{time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(timestamp))}] '
+                    f'"{method} {path} {version}" {status} {size} {duration:.4f}\n')
+
+        message, args = fields
+        if args:
+            message = message % args
+        if self.fmt == "json":
+            return json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp)),
+                "level": _LEVEL_NAMES[level], "message": message,
+            }) + "\n"
+        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} {_LEVEL_NAMES[level]} {message}\n"
+
+    def log(self, level, message, *args):
+        # taso tarkistetaan ennen kuin mitään muuta tehdään, joten pois päältä oleva
+        # debug-loki ei maksa juuri mitään
+        # args yhdistetään viestiin (message % args) vasta taustasäikeessä
+        if level >= self.level:
+            self._put((level, time.time(), (message, args)))
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+    def access(self, remote, method, path, version, status, size, duration):
+        # yksi rivi jokaisesta käsitellystä requestista (INFO-taso)
+        if INFO >= self.level:
+            self._put((_ACCESS, time.time(), (remote, method, path, version, status, size, duration)))
+
+    def _put(self, record):
+        # request ei jää odottamaan lokia: täydestä jonosta rivi pudotetaan
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self):
+        # kirjoittaa jonossa olevat rivit ja pysäyttää taustasäikeen
+        # (put odottaa tarvittaessa, että taustasäie tekee jonoon tilaa)
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+log = AccessLog()
+
+
+def configure(level="info", fmt="common", path=None):
+    # esim. configure("debug", "json", "access.log")
+    log.level = LEVELS[level]
+    log.fmt = fmt
+    if path is not None:
+        log.stream = open(path, "a", encoding="utf-8", buffering=1024 * 1024)
+
+
+def _restart_after_fork():
+    # forkatussa prosessissa (prefork) taustasäie ei ole enää käynnissä,
+    # joten se käynnistetään uudestaan
+    log._start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(log.close)
@@ -0,0 +1,244 @@
+# asyncio-pohjainen serveri
+#
+# threaded-serverissä jokainen yhteys varaa oman säikeen (thread) ja sen pinon,
+# vaikka yhteys vain odottaisi seuraavaa requestia (keep-alive)
+# asyncio-serverissä kaikki yhteydet käsitellään yhdessä säikeessä:
+# kun yhteydeltä odotetaan dataa, event loop käsittelee sillä välin muita yhteyksiä
+#
+# huom: handle_request on tavallinen (ei async) funktio, ja se ajetaan event loopissa,
+# joten sen pitää olla nopea. hidas handle_request pysäyttää kaikki muutkin yhteydet
+import asyncio
+import os
+import signal
+import threading
+import time
+
+import access_log
+import graceful
+import http_parser
+import http_server
+import limits
+import metrics
+import tls
+
+
+async def drain_writer(writer, deadline):
+    # writer.drain() odottaa, jos clientin lähetyspuskuri on täynnä, mutta enintään
+    # responsen lähettämisen aikarajaan asti (ks. limits.WriteDeadline)
+    timeout = deadline.remaining()
+    if timeout <= 0:
+        raise asyncio.TimeoutError
+    await asyncio.wait_for(writer.drain(), timeout)
+
+
+async def send_file(writer, response, keep_alive, deadline):
+    try:
+        head = response.head(keep_alive)
+        writer.write(head)
+        deadline.sent(len(head))
+        await drain_writer(writer, deadline)
+        # loop.sendfile() käyttää os.sendfile()ä, jos se on mahdollista, ja muuten lukee tiedoston paloina
+        # se on yksi kutsu, joten koko tiedoston lisäaika (ks. limits.WriteDeadline) annetaan etukäteen
+        deadline.sent(response.count)
+        timeout = deadline.remaining()
+        if timeout <= 0:
+            raise asyncio.TimeoutError
+        return len(head) + await asyncio.wait_for(
+            asyncio.get_running_loop().sendfile(writer.transport, response.file, response.offset, response.count),
+            timeout)
+    finally:
+        response.file.close()
+
+
+async def handle_connection(reader, writer, handle_request, connection_limits=None,
+                            max_requests=http_server.MAX_REQUESTS_PER_CONNECTION,
+                            max_header_size=http_parser.MAX_HEADER_SIZE,
+                            max_body_size=http_parser.MAX_BODY_SIZE, drain=None, upload_limit=None):
+    # sama logiikka kuin http_server.handle_connectionissa, mutta
+    # recv() ja sendall() on korvattu reader.read()- ja writer.write()-kutsuilla
+    # requestin käsittely ennen ja jälkeen lähettämisen on yhteinen (http_server.Exchange)
+    peername = writer.get_extra_info("peername")
+    remote = peername[0] if peername else "-"
+    access_log.log.debug("Client connected from %s", peername)
+    if connection_limits is None:
+        connection_limits = limits.Limits()
+    write_timeout = connection_limits.write_timeout
+    deadline = limits.ReadDeadline(connection_limits)
+    parser = http_parser.RequestParser(max_header_size, max_body_size, upload_limit)
+    handled = 0
+    metrics.inc("http_active_connections")
+    if drain is not None:
+        # herättäminen: reader.read() palauttaa vielä jo luetun datan ja sen jälkeen b""
+        # (writer.close() sulkisi myös lähetyssuunnan kesken responsen)
+        drain.add(writer, reader.feed_eof, writer.transport.abort)
+    try:
+        while handled < max_requests:
+            try:
+                parse_started = time.perf_counter()
+                request = parser.next_request()
+                parse_time = time.perf_counter() - parse_started
+                while request is None:
+                    if parser.expects_continue:
+                        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                        parser.expects_continue = False
+                    if drain is not None and parser.idle:
+                        drain.idle(writer)
+                    timeout = deadline.timeout(parser)
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError
+                    data = await asyncio.wait_for(reader.read(65536), timeout)
+                    if not data:
+                        return
+                    if drain is not None:
+                        drain.busy(writer)
+                    metrics.inc("http_bytes_received_total", len(data))
+                    parse_started = time.perf_counter()
+                    parser.feed(data)
+                    request = parser.next_request()
+                    parse_time += time.perf_counter() - parse_started
+            except http_parser.HttpParseError as e:
+                writer.write(b"".join(http_server.iter_response(http_server.error_response(e.status, e.reason))))
+                await drain_writer(writer, limits.WriteDeadline(write_timeout))
+                return
+            except asyncio.TimeoutError:
+                # odottava keep-alive-yhteys suljetaan hiljaa, kesken jäänyt request saa 408:n
+                if deadline.expired():
+                    writer.write(b"".join(http_server.iter_response(
+                        http_server.error_response(408, "Request Timeout"))))
+                    await drain_writer(writer, limits.WriteDeadline(write_timeout))
+                return
+            deadline.reset()
+
+            handled += 1
+            exchange = http_server.Exchange(
+                request, remote, parse_time,
+                http_server.wants_keep_alive(request.version, request.headers) and handled < max_requests)
+            response = exchange.respond(handle_request, connection_limits, drain)
+            keep_alive = exchange.keep_alive
+
+            # koko responsen lähettämisellä on yksi aikaraja (ks. limits.WriteDeadline)
+            write_deadline = limits.WriteDeadline(write_timeout)
+            if isinstance(response, http_server.FileResponse):
+                sent = await send_file(writer, response, keep_alive, write_deadline)
+            elif isinstance(response, http_server.StreamingResponse):
+                sent = 0
+                for data in http_server.iter_response(response, keep_alive, request.version):
+                    writer.write(data)
+                    sent += len(data)
+                    write_deadline.sent(len(data))
+                    # drain() odottaa, jos clientin lähetyspuskuri on täynnä
+                    # näin hidas client ei saa serverin muistia täyteen
+                    await drain_writer(writer, write_deadline)
+            else:
+                # Responsen ja BufferResponsen palat ovat valmiina: writelines() antaa ne kaikki
+                # transportille kerralla, joten drain() tarvitaan vain kerran
+                buffers = list(http_server.iter_response(response, keep_alive))
+                writer.writelines(buffers)
+                sent = sum(map(len, buffers))
+                write_deadline.sent(sent)
+                await drain_writer(writer, write_deadline)
+            exchange.finish(sent)
+            if not keep_alive:
+                break
+    except asyncio.TimeoutError:
+        # client ei lukenut responsea ajoissa
+        # writer.close() yrittäisi vielä lähettää puskuroidun datan, joten yhteys katkaistaan
+        metrics.inc("http_timeouts_total", labels=(("phase", "write"),))
+        writer.transport.abort()
+    except Exception as e:
+        access_log.log.error(f"Error handling client: {e}")
+    finally:
+        metrics.inc("http_active_connections", -1)
+        if drain is not None:
+            drain.remove(writer)
+        writer.close()
+        access_log.log.debug("Client disconnected.")
+
+
+async def serve(host, port, handle_request, shutdown_timeout=graceful.SHUTDOWN_TIMEOUT, connection_limits=None,
+                ssl_context=None, upload_limit=None):
+    # SIGTERM / Ctrl+C: lopetetaan uusien yhteyksien hyväksyminen ja odotetaan, että
+    # kesken olevat requestit valmistuvat (enintään shutdown_timeout sekuntia)
+    # SIGHUP: käynnistetään uusi prosessi, joka perii kuuntelevan socketin, ks. graceful.py
+    # connection_limits: aikarajat ja clienttikohtaiset rajat (ks. limits.py)
+    # ssl_context: HTTPS, jos annettu (ks. tls.py)
+    loop = asyncio.get_running_loop()
+    if connection_limits is None:
+        connection_limits = limits.Limits(max_connections_per_ip=0)
+    drain = graceful.Drain()
+    tasks = set()
+    stop = asyncio.Event()
+
+    async def client_connected(reader, writer):
+        # TCP_NODELAY, ks. http_server.set_nodelay
+        # (asyncio asettaa sen itse vain socketeille, jotka on luotu protolla IPPROTO_TCP)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            http_server.set_nodelay(sock)
+        ssl_object = writer.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            tls.record_handshake(ssl_object)
+        peername = writer.get_extra_info("peername")
+        ip = peername[0] if peername else "-"
+        if not connection_limits.acquire(ip):
+            # ip:llä on jo liikaa yhteyksiä
+            writer.write(http_server.overloaded_response("429 Too Many Requests"))
+            writer.close()
+            return
+        task = asyncio.current_task()
+        tasks.add(task)
+        try:
+            await handle_connection(reader, writer, handle_request, connection_limits, drain=drain,
+                                    upload_limit=upload_limit)
+        finally:
+            tasks.discard(task)
+            connection_limits.release(ip)
+
+    async def reload():
+        try:
+            ready_fd = graceful.spawn_replacement(server_socket)
+        except OSError as e:
+            access_log.log.error(f"Reload failed: {e}")
+            return
+        # odotetaan uutta prosessia säikeessä, jotta event loop jatkaa yhteyksien käsittelyä
+        if await loop.run_in_executor(None, graceful.wait_ready, ready_fd):
+            access_log.log.info("# Replacement process is ready. Shutting down. #")
+            stop.set()
+        else:
+            access_log.log.error("Replacement process exited before it was ready, keeping this one")
+
+    server_socket = graceful.inherited_socket()
+    if server_socket is None:
+        server_socket = http_server.create_server_socket(host, port)
+    server_socket.setblocking(False)
+    # asyncio tekee TLS-kättelyn event loopissa lukematta socketia blokkaavasti,
+    # joten hidas kättely ei estä muita yhteyksiä
+    server = await asyncio.start_server(client_connected, sock=server_socket, ssl=ssl_context,
+                                        ssl_handshake_timeout=connection_limits.header_timeout
+                                        if ssl_context is not None else None)
+    # signaalikäsittelijät voi asettaa vain pääsäikeessä
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload()))
+    scheme = "https" if ssl_context is not None else "http"
+    access_log.log.info(f"Server listening on {scheme}://{host}:{port} (asyncio, pid {os.getpid()})")
+    graceful.notify_ready()
+
+    await stop.wait()
+    access_log.log.info("# Shutting down. #")
+    server.close()
+    drain.start()
+    if tasks:
+        _, pending = await asyncio.wait(set(tasks), timeout=shutdown_timeout)
+        if pending:
+            access_log.log.warning(f"Closing {len(pending)} connections after {shutdown_timeout}s shutdown timeout")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending, timeout=1)
+
+
+def start_server(host, port, handle_request, shutdown_timeout=graceful.SHUTDOWN_TIMEOUT, connection_limits=None,
+                 ssl_context=None, upload_limit=None):
+    asyncio.run(serve(host, port, handle_request, shutdown_timeout, connection_limits, ssl_context, upload_limit))
@@ -0,0 +1,382 @@
+# suorituskykymittaukset (benchmark)
+#
+# server: käynnistää serverin (app.py, teht1_server.py tai render_template_example.py)
+# paikalliseen porttiin ja lähettää sille requesteja useasta yhteydestä yhtä aikaa
+#
+#   python benchmark.py server --server render_template_example.py --connections 16 --duration 10
+#   python benchmark.py server --server app.py --no-keep-alive --mix "/=3,POST /submit=1"
+#   python benchmark.py server --server teht1_server.py --server-args "--mode asyncio"
+#
+# templates: mittaa template_engine.render_simple_templaten nopeutta eri kokoisilla
+# listoilla ja sisäkkäisillä for-silmukoilla
+#
+#   python benchmark.py templates
+#
+# tulokset tulostetaan JSON-muodossa (tai tallennetaan --output-tiedostoon),
+# jotta eri versioiden tuloksia voi verrata keskenään
+#
+# huom: client ajetaan samalla koneella ja pythonin säikeillä (GIL), joten se kilpailee
+# serverin kanssa prosessoriajasta. tulokset sopivat muutosten vertailuun, eivät absoluuttisiksi luvuiksi
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+import template_engine
+
+HOST = "127.0.0.1"
+PORT = 9090
+# oletuksena vain ne pathit, jotka valitulla serverillä on (muut saisivat 404:n ja vääristäisivät tuloksen)
+DEFAULT_MIXES = {
+    "app.py": "/=1,POST /submit=1",
+    "teht1_server.py": "/users=1",
+    "render_template_example.py": "/users=1,/posts=1",
+}
+SUBMIT_BODY = b"name=Juhani&message=Hello+World"
+
+
+def parse_mix(mix):
+    # "/=3,POST /submit=1" -> [("GET", "/", 3), ("POST", "/submit", 1)]
+    requests = []
+    for item in mix.split(","):
+        target, _, weight = item.strip().rpartition("=")
+        method, _, path = target.rpartition(" ")
+        requests.append((method or "GET", path, float(weight)))
+    return requests
+
+
+def build_request(method, path, keep_alive):
+    connection = "keep-alive" if keep_alive else "close"
+    if method == "POST":
+        return (f"POST {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: {connection}\r\n"
+                f"Content-Type: application/x-www-form-urlencoded\r\n"
+                f"Content-Length: {len(SUBMIT_BODY)}\r\n\r\n").encode() + SUBMIT_BODY
+    return f"{method} {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: {connection}\r\n\r\n".encode()
+
+
+class _ResponseReader:
+    # lukee socketista yhden responsen kerrallaan
+    # body luetaan Content-Lengthin, chunked-koodauksen tai yhteyden sulkemisen perusteella
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("connection closed by server")
+        self.buffer += data
+
+    def _read_line(self):
+        while b"\r\n" not in self.buffer:
+            self._fill()
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line
+
+    def _read_exactly(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_response(self):
+        # palauttaa (status, sulkeeko serveri yhteyden)
+        while b"\r\n\r\n" not in self.buffer:
+            self._fill()
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+        close = headers.get("connection") == "close" or lines[0].startswith("HTTP/1.0")
+
+        if status == 304 or status < 200:
+            return status, close
+        if headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int(self._read_line().split(b";")[0], 16)
+                self._read_exactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            self._read_exactly(int(headers["content-length"]))
+        else:
+            # ei pituutta: body päättyy, kun serveri sulkee yhteyden
+            try:
+                while True:
+                    self._fill()
+            except ConnectionError:
+                pass
+            self.buffer = b""
+            close = True
+        return status, close
+
+
+def _client(host, port, requests, keep_alive, deadline, seed, results):
+    # yksi yhteys: lähettää requesteja peräkkäin, kunnes aika loppuu
+    rng = random.Random(seed)
+    choices = [(method, path) for method, path, _ in requests]
+    weights = [weight for _, _, weight in requests]
+    encoded = {(method, path): build_request(method, path, keep_alive) for method, path in choices}
+    latencies, statuses, errors = [], {}, 0
+    sock = reader = None
+    while time.perf_counter() < deadline:
+        method, path = rng.choices(choices, weights)[0]
+        started = time.perf_counter()
+        try:
+            if sock is None:
+                sock = socket.create_connection((host, port))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                reader = _ResponseReader(sock)
+            sock.sendall(encoded[(method, path)])
+            status, close = reader.read_response()
+        except OSError:
+            # serveri sulki keep-alive-yhteyden (esim. max requests) tai yhteys katkesi
+            errors += 1
+            if sock is not None:
+                sock.close()
+            sock = None
+            continue
+        latency = time.perf_counter() - started
+        latencies.append((path, latency))
+        statuses[status] = statuses.get(status, 0) + 1
+        if close or not keep_alive:
+            sock.close()
+            sock = None
+    if sock is not None:
+        sock.close()
+    results.append((latencies, statuses, errors))
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    values = sorted(values)
+
+    def percentile(p):
+        # nearest rank
+        return round(values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))] * 1000, 3)
+
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99),
+            "max": round(values[-1] * 1000, 3), "mean": round(sum(values) / len(values) * 1000, 3)}
+
+
+def run_load(host, port, requests, connections, duration, keep_alive):
+    results = []
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [threading.Thread(target=_client, args=(host, port, requests, keep_alive, deadline, i, results))
+               for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies, statuses, errors = [], {}, 0
+    for thread_latencies, thread_statuses, thread_errors in results:
+        latencies += thread_latencies
+        errors += thread_errors
+        for status, count in thread_statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    by_path = {}
+    for path, latency in latencies:
+        by_path.setdefault(path, []).append(latency)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "latency_ms": _percentiles([latency for _, latency in latencies]),
+        "status": statuses,
+        "paths": {path: dict(requests=len(values), **_percentiles(values)) for path, values in sorted(by_path.items())},
+    }
+
+
+def _wait_for_port(host, port, process, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start listening on {host}:{port}")
+
+
+def start_server(script, host, port, server_args=()):
+    # serveri käynnistetään tämän tiedoston hakemistossa, koska templatet ja static-tiedostot
+    # haetaan suhteellisilla poluilla (./templates/...)
+    # access-loki jätetään pois, jotta sen kirjoittaminen ei vaikuta tuloksiin
+    # kaikki clientin yhteydet tulevat samasta ip:stä, joten ip-kohtainen yhteysraja poistetaan
+    # (--server-args voi asettaa sen uudestaan)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, script, "--host", host, "--port", str(port), "--log-level", "warning",
+         "--max-connections-per-ip", "0", *server_args],
+        cwd=directory, stdout=subprocess.DEVNULL)
+    try:
+        _wait_for_port(host, port, process)
+    except Exception:
+        stop_server(process)
+        raise
+    return process
+
+
+def stop_server(process):
+    # SIGINT vastaa Ctrl+C:tä, jonka kaikki serverit osaavat käsitellä
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def benchmark_server(args):
+    requests = parse_mix(args.mix if args.mix is not None else DEFAULT_MIXES[args.server])
+    server_args = shlex.split(args.server_args)
+    process = start_server(args.server, args.host, args.port, server_args)
+    try:
+        if args.warmup > 0:
+            run_load(args.host, args.port, requests, args.connections, args.warmup, args.keep_alive)
+        result = run_load(args.host, args.port, requests, args.connections, args.duration, args.keep_alive)
+    finally:
+        stop_server(process)
+    return {
+        "benchmark": "server",
+        "server": args.server,
+        "server_args": server_args,
+        "connections": args.connections,
+        "duration": args.duration,
+        "keep_alive": args.keep_alive,
+        "mix": [{"method": method, "path": path, "weight": weight} for method, path, weight in requests],
+        **result,
+    }
+
+
+def _nested_template(depth):
+    # depth 2: {% for level1 in level0 %}{% for level2 in level1 %}<i>{{ level2 }}</i>{% endfor %}{% endfor %}
+    opening = "".join(f"{{% for level{i + 1} in level{i} %}}" for i in range(depth))
+    closing = "{% endfor %}" * depth
+    return f"<ul>{opening}<li>{{{{ level{depth} }}}}</li>{closing}</ul>"
+
+
+def _nested_data(depth, width):
+    items = [f"item {i}" for i in range(width)]
+    for _ in range(depth - 1):
+        items = [items] * width
+    return {"level0": items}
+
+
+def _time_call(function, min_time):
+    # toistaa funktiota, kunnes mittaus kestää vähintään min_time sekuntia,
+    # ja palauttaa parhaan kolmesta tuloksesta mikrosekunteina per kutsu
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=3, number=number)) / number
+    return round(best * 1_000_000, 3), number
+
+
+def benchmark_templates(args):
+    cases = []
+    list_template = "<ul>{% for item in items %}<li>{{ item }}</li>{% endfor %}</ul>"
+    for size in args.sizes:
+        data = {"items": [f"item {i}" for i in range(size)]}
+        cases.append(("list", {"items": size}, list_template, data))
+    for depth in args.depths:
+        cases.append(("nested", {"depth": depth, "width": args.width},
+                      _nested_template(depth), _nested_data(depth, args.width)))
+
+    results = []
+    for name, params, source, data in cases:
+        # render_simple_template kääntää templaten joka kerta,
+        # compiled mittaa valmiiksi käännetyn templaten renderöinnin (kuten template_loader)
+        template = template_engine.compile_template(source)
+        simple_us, simple_number = _time_call(lambda: template_engine.render_simple_template(source, data),
+                                              args.min_time)
+        compiled_us, compiled_number = _time_call(lambda: template.render(data), args.min_time)
+        results.append({
+            "case": name,
+            **params,
+            "output_bytes": len(template.render(data).encode()),
+            "render_simple_template_us": simple_us,
+            "compiled_render_us": compiled_us,
+            "iterations": {"render_simple_template": simple_number, "compiled_render": compiled_number},
+        })
+    return {"benchmark": "templates", "results": results}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks for the example servers and the template engine.")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file instead of stdout")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    server = subparsers.add_parser("server", help="load-test a server")
+    server.add_argument("--server", default="render_template_example.py",
+                        choices=["app.py", "teht1_server.py", "render_template_example.py"])
+    server.add_argument("--server-args", default="", help='extra arguments for the server, e.g. "--mode asyncio"')
+    server.add_argument("--host", default=HOST)
+    server.add_argument("--port", type=int, default=PORT)
+    server.add_argument("--connections", type=int, default=16)
+    server.add_argument("--duration", type=float, default=10.0)
+    server.add_argument("--warmup", type=float, default=1.0)
+    server.add_argument("--keep-alive", action=argparse.BooleanOptionalAction, default=True)
+    server.add_argument("--mix", default=None,
+                        help='weighted request mix, e.g. "/=3,POST /submit=1" (default: the routes of --server)')
+
+    templates = subparsers.add_parser("templates", help="template engine microbenchmarks")
+    templates.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    templates.add_argument("--depths", type=int, nargs="+", default=[1, 2, 3, 4])
+    templates.add_argument("--width", type=int, default=6, help="items per level in the nested case")
+    templates.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.benchmark == "server":
+        result = benchmark_server(args)
+    else:
+        result = benchmark_templates(args)
+    result = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        **result,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
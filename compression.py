@@ -0,0 +1,196 @@
+# responsejen pakkaus (gzip, ja brotli, jos brotli-kirjasto on asennettu)
+#
+# client kertoo Accept-Encoding-headerissa, mitä pakkausmuotoja se ymmärtää:
+#   Accept-Encoding: gzip, deflate, br
+# serveri pakkaa bodyn ja kertoo käyttämänsä muodon Content-Encoding-headerissa
+# Vary: Accept-Encoding kertoo välissä oleville välimuisteille (proxy, selain), että
+# saman urlin response riippuu Accept-Encoding-headerista
+#
+# pakkaaminen vie prosessoriaikaa, joten
+# - pieniä bodyja (alle MIN_SIZE tavua) ei pakata, koska säästö olisi olematon
+# - jo valmiiksi pakattuja muotoja (kuvat, zip) ei pakata uudestaan
+# - saman bodyn pakattu versio muistetaan (bodyn sha1-tiivisteen perusteella),
+#   joten toistuvat responset pakataan vain kerran
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+import http_server
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024
+LEVEL = 6
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+# pakattuja tiedostoja (FileResponse) ei pakata, jos ne ovat tätä isompia
+MAX_FILE_SIZE = 1024 * 1024
+
+
+def is_compressible(content_type):
+    return content_type is not None and content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def negotiate(accept_encoding):
+    # palauttaa "br", "gzip" tai None
+    # q=0 tarkoittaa, että client ei hyväksy kyseistä muotoa: gzip;q=0
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data)
+    # wbits=31 tuottaa gzip-muotoista dataa (header + deflate + crc)
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    # pakkaa StreamingResponsen palat sitä mukaa kun ne valmistuvat
+    # jokaisen palan jälkeen pakkaaja tyhjennetään (flush), jotta pala lähtee clientille heti:
+    # muuten pakkaaja pitäisi dataa puskurissaan, kunnes sitä on kertynyt kymmeniä kilotavuja,
+    # ja client saisi ensimmäiset tavut vasta paljon myöhemmin kuin pakkaamattomana
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+
+        def flush():
+            # Z_SYNC_FLUSH tyhjentää puskurin, mutta pakkaus jatkuu samassa gzip-virrassa
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        data = process(chunk.encode() if isinstance(chunk, str) else chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionCache:
+    # muistaa pakatut bodyt, avaimena (bodyn tunniste, pakkausmuoto)
+    # vähiten aikaa sitten käytetty poistetaan ensin (LRU)
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, encoding):
+        with self._lock:
+            compressed = self._entries.get((key, encoding))
+            if compressed is not None:
+                self._entries.move_to_end((key, encoding))
+            return compressed
+
+    def get_or_compress(self, key, data, encoding):
+        compressed = self.get(key, encoding)
+        if compressed is not None:
+            return compressed
+        compressed = compress(data, encoding)
+        with self._lock:
+            if (key, encoding) not in self._entries:
+                self._entries[(key, encoding)] = compressed
+                self._size += len(compressed)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, removed = self._entries.popitem(last=False)
+                self._size -= len(removed)
+        return compressed
+
+
+cache = CompressionCache()
+
+
+def variant_etag(etag, encoding):
+    # pakatulla versiolla pitää olla eri ETag kuin pakkaamattomalla: "abc" -> "abc-gzip"
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def strip_variant(etag):
+    # "abc-gzip" -> "abc"
+    for encoding in ("gzip", "br"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+# pakkaamatonkin response riippuu Accept-Encoding-headerista, jos se olisi voitu pakata
+VARY = ("Vary", "Accept-Encoding")
+
+
+def _compressed(response, body, encoding):
+    # pakattu response: ETagiin lisätään pakkausmuoto, koska pakattu versio on eri kuin pakkaamaton
+    headers = tuple((name, variant_etag(value, encoding) if name.lower() == "etag" else value)
+                    for name, value in response.headers)
+    return http_server.Response(body, response.status, headers + (("Content-Encoding", encoding), VARY))
+
+
+def _negotiated(response):
+    # responselle on jo valittu pakkausmuoto (esim. response_cachen valmiit versiot)
+    return response.header("Content-Encoding") or "accept-encoding" in (response.header("Vary") or "").lower()
+
+
+def compress_response(request_headers, response):
+    # pakkaa handle_requestin palauttaman responsen, jos client ja responsen tyyppi sen sallivat
+    if not is_compressible(response.header("Content-Type")) or _negotiated(response):
+        return response
+
+    if isinstance(response, http_server.FileResponse):
+        # vain kokonaiset (ei Range) ja pienehköt tekstitiedostot pakataan
+        # pakattu versio muistetaan tiedoston nimen ja ETagin (muutosaika + koko) perusteella
+        etag = response.header("ETag")
+        if response.status != 200 or etag is None or not MIN_SIZE <= response.count <= MAX_FILE_SIZE:
+            return response
+        encoding = negotiate(request_headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response.with_headers((VARY,))
+        key = (response.file.name, etag)
+        try:
+            compressed = cache.get(key, encoding)
+            if compressed is None:
+                response.file.seek(response.offset)
+                compressed = cache.get_or_compress(key, response.file.read(response.count), encoding)
+        finally:
+            response.file.close()
+        return _compressed(response, compressed, encoding)
+
+    encoding = negotiate(request_headers.get("Accept-Encoding"))
+    if isinstance(response, http_server.StreamingResponse):
+        if encoding is None:
+            return response.with_headers((VARY,))
+        return http_server.StreamingResponse(compress_stream(response.chunks, encoding), response.status,
+                                             response.headers + (("Content-Encoding", encoding), VARY))
+
+    # Response tai BufferResponse: pakattaessa BufferResponsen palat on pakko yhdistää,
+    # pakkaamaton response lähetetään paloina
+    buffers = response.buffers if isinstance(response, http_server.BufferResponse) else (response.body,)
+    if encoding is None or sum(map(len, buffers)) < MIN_SIZE:
+        return response.with_headers((VARY,))
+    data = b"".join(buffers)
+    compressed = cache.get_or_compress(hashlib.sha1(data).digest(), data, encoding)
+    return _compressed(response, compressed, encoding)
@@ -0,0 +1,194 @@
+# tietokantakerros (SQLite) /users- ja /posts-sivuille
+#
+# yhteysallas (pool): sqlite3-yhteyden avaaminen vie aikaa, joten valmiit yhteydet pidetään jonossa
+# ja jokainen request lainaa yhden ja palauttaa sen. yhteydet avataan vasta kun niitä tarvitaan,
+# joten prefork-serverin workerit (fork) avaavat omansa eivätkä jaa masterin yhteyksiä
+#
+# prepared statementit: sqlite3 kääntää SQL-lauseen kerran ja pitää käännetyn lauseen
+# yhteyden välimuistissa (cached_statements), kun SQL-teksti on täsmälleen sama. siksi kyselyt ovat
+# moduulin vakioita ja arvot annetaan ?-parametreina eikä niitä koskaan liitetä SQL-tekstiin
+#
+# sivutus (keyset pagination): OFFSET 100000 joutuisi käymään läpi 100000 riviä ennen oikeaa sivua,
+# joten seuraava sivu haetaan edellisen sivun viimeisen id:n perusteella:
+#   SELECT ... WHERE id > :after ORDER BY id LIMIT :limit
+# primary key -indeksin ansiosta jokainen sivu on yhtä nopea, vaikka rivejä olisi miljoonia
+#   /users?limit=20            -> ensimmäiset 20
+#   /users?after=20&limit=20   -> seuraavat 20
+#
+# testidatan luominen (esim. miljoona riviä):
+#   python database.py --users 1000000 --posts 1000000
+import argparse
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import profiler
+
+DATABASE = "./data.sqlite3"
+POOL_SIZE = 8
+# kuinka monta käännettyä SQL-lausetta yksi yhteys pitää muistissa
+CACHED_STATEMENTS = 64
+# sivun oletuskoko ja maksimikoko
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users (id),
+    title TEXT NOT NULL
+);
+"""
+
+USERS_PAGE = "SELECT id, name FROM users WHERE id > ? ORDER BY id LIMIT ?"
+POSTS_PAGE = ("SELECT posts.id, posts.title, users.name FROM posts LEFT JOIN users ON users.id = posts.user_id "
+              "WHERE posts.id > ? ORDER BY posts.id LIMIT ?")
+
+
+class ConnectionPool:
+    # säieturvallinen sqlite3-yhteysallas
+    # käyttö:
+    #   with pool.connection() as connection:
+    #       rows = connection.execute(USERS_PAGE, (0, 20)).fetchall()
+
+    def __init__(self, path=DATABASE, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        # check_same_thread=False: yhteys voi siirtyä säikeeltä toiselle, koska pool
+        # huolehtii siitä, että sitä käyttää vain yksi säie kerrallaan
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+                                     isolation_level=None)
+        # WAL: lukijat eivät odota kirjoittajaa eivätkä toisiaan
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # fork: vanhemman prosessin yhteyksiä ei saa käyttää, aloitetaan tyhjästä
+            self._idle = queue.LifoQueue()
+            self._opened = 0
+            self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                opening = True
+            else:
+                opening = False
+        if opening:
+            try:
+                return self._open()
+            except sqlite3.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        # kaikki yhteydet ovat käytössä: odotetaan, että joku palauttaa omansa
+        return self._idle.get()
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put(connection)
+
+    def close(self):
+        # sulkee vapaana olevat yhteydet
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+
+
+def create_schema(pool):
+    with pool.connection() as connection:
+        connection.executescript(SCHEMA)
+
+
+def seed(pool, users=1000, posts=10000, batch_size=10000):
+    # lisää testidataa, kunnes tauluissa on vähintään users ja posts riviä
+    with pool.connection() as connection:
+        user_count = connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        post_count = connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+        total_users = max(user_count, users)
+        # executemany() kääntää INSERT-lauseen kerran ja ajaa sen jokaiselle riville
+        # yksi transaktio per batch, koska jokainen commit kirjoittaa levylle
+        for start in range(user_count, users, batch_size):
+            connection.execute("BEGIN")
+            connection.executemany("INSERT INTO users (name) VALUES (?)",
+                                   ((f"User {i + 1}",) for i in range(start, min(users, start + batch_size))))
+            connection.execute("COMMIT")
+        for start in range(post_count, posts, batch_size):
+            connection.execute("BEGIN")
+            connection.executemany("INSERT INTO posts (user_id, title) VALUES (?, ?)",
+                                   ((i % total_users + 1 if total_users else None, f"Post {i + 1}")
+                                    for i in range(start, min(posts, start + batch_size))))
+            connection.execute("COMMIT")
+
+
+def parse_page(query, default_limit=PAGE_SIZE, max_limit=MAX_PAGE_SIZE):
+    # ?after=20&limit=10 -> (20, 10), heittää ValueErrorin, jos arvot eivät ole kelvollisia
+    after = int(query.get("after", ["0"])[0])
+    limit = int(query.get("limit", [str(default_limit)])[0])
+    if after < 0 or not 0 < limit <= max_limit:
+        raise ValueError("invalid page")
+    return after, limit
+
+
+def _page(pool, sql, after, limit):
+    # haetaan yksi rivi enemmän kuin sivulle mahtuu, jotta tiedetään, onko seuraavaa sivua
+    # palauttaa (rivit, seuraavan sivun after tai None)
+    started = time.perf_counter()
+    with pool.connection() as connection:
+        rows = connection.execute(sql, (after, limit + 1)).fetchall()
+    # hitaiden requestien lokiin (ks. profiler.py) näkyy myös yhteyden odottamiseen kulunut aika
+    profiler.record("sql", time.perf_counter() - started)
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][0]
+    return rows, None
+
+
+def users_page(pool, after=0, limit=PAGE_SIZE):
+    rows, next_after = _page(pool, USERS_PAGE, after, limit)
+    return [{"id": user_id, "name": name} for user_id, name in rows], next_after
+
+
+def posts_page(pool, after=0, limit=PAGE_SIZE):
+    rows, next_after = _page(pool, POSTS_PAGE, after, limit)
+    return [{"id": post_id, "title": title, "author": author} for post_id, title, author in rows], next_after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    args = parser.parse_args()
+    pool = ConnectionPool(args.database, 1)
+    create_schema(pool)
+    seed(pool, args.users, args.posts)
+    pool.close()
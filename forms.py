@@ -0,0 +1,290 @@
+# lomakkeiden (form) ja query stringien parsiminen
+#
+# application/x-www-form-urlencoded (sama muoto kuin query string):
+#   first_name=Jorma&tags=a&tags=b&message=Hello+World%21
+# - & erottaa kentät, ensimmäinen = erottaa nimen ja arvon (a=b=c -> a: "b=c")
+# - + on välilyönti ja %XX on tavu heksalukuna (%21 = !)
+# - sama nimi voi esiintyä useamman kerran, joten arvot ovat listoja: {"tags": ["a", "b"]}
+#
+# multipart/form-data (tiedostojen lähetys):
+#   --raja
+#   Content-Disposition: form-data; name="avatar"; filename="kuva.png"
+#   Content-Type: image/png
+#
+#   ...tiedoston tavut...
+#   --raja--
+#
+# multipart-body parsitaan paloina sitä mukaa kun se tulee socketista (http_parser.RequestParser),
+# joten koko bodyn ei tarvitse mahtua muistiin: tiedostot pidetään muistissa SPOOL_SIZE tavuun asti
+# ja sen jälkeen ne kirjoitetaan väliaikaistiedostoon
+#
+# käyttö router-funktiossa:
+#
+#   form = forms.parse_form(request)
+#   name = form.get("name")
+#   avatar = form.files.get("avatar")  # [UploadedFile], avatar[0].file on tiedosto-olio
+import os
+import re
+import tempfile
+from urllib.parse import unquote_plus
+
+# tätä isommat tiedostot kirjoitetaan levylle
+SPOOL_SIZE = 1024 * 1024
+# multipart-osan headerien maksimikoko
+MAX_PART_HEADER_SIZE = 8192
+# tavallisen (ei tiedosto) kentän maksimikoko
+MAX_FIELD_SIZE = 1024 * 1024
+MAX_PARTS = 1000
+
+_PARAM_RE = re.compile(r';\s*([\w*-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class FormError(ValueError):
+    pass
+
+
+def parse_qs(data, encoding="utf-8"):
+    # "a=1&b=2&a=3" -> {"a": ["1", "3"], "b": ["2"]}
+    # data voi olla merkkijono (query string) tai tavuja (request body)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode(encoding, "replace")
+    result = {}
+    for pair in data.split("&"):
+        if not pair:
+            continue
+        name, _, value = pair.partition("=")
+        # unquote_plus on hidas, joten sitä kutsutaan vain, jos siitä on hyötyä
+        if "%" in name or "+" in name:
+            name = unquote_plus(name, encoding, "replace")
+        if "%" in value or "+" in value:
+            value = unquote_plus(value, encoding, "replace")
+        values = result.get(name)
+        if values is None:
+            result[name] = [value]
+        else:
+            values.append(value)
+    return result
+
+
+class UploadedFile:
+    # yksi multipart-lomakkeella lähetetty tiedosto
+    # file on avoin tiedosto-olio (muistissa tai väliaikaistiedostona), joka on luettu alkuun
+    __slots__ = ("name", "filename", "content_type", "headers", "file", "size")
+
+    def __init__(self, name, filename, content_type, headers, file, size):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.file = file
+        self.size = size
+
+    def __repr__(self):
+        return f"<UploadedFile {self.name} {self.filename!r} {self.size} bytes>"
+
+
+class FormData:
+    # fields: {nimi: [arvo, ...]}, files: {nimi: [UploadedFile, ...]}
+    def __init__(self, fields=None, files=None):
+        self.fields = fields if fields is not None else {}
+        self.files = files if files is not None else {}
+
+    def get(self, name, default=None):
+        values = self.fields.get(name)
+        return values[0] if values else default
+
+    def getlist(self, name):
+        return self.fields.get(name, [])
+
+    def close(self):
+        # poistaa väliaikaistiedostot
+        for uploads in self.files.values():
+            for upload in uploads:
+                upload.file.close()
+
+    def __repr__(self):
+        return f"<FormData fields={self.fields} files={self.files}>"
+
+
+def _parse_params(value):
+    # 'form-data; name="avatar"; filename="kuva.png"' -> ("form-data", {"name": "avatar", "filename": "kuva.png"})
+    main, _, rest = value.partition(";")
+    params = {}
+    for match in _PARAM_RE.finditer(";" + rest):
+        name, param = match.groups()
+        param = param.strip()
+        if param.startswith('"') and param.endswith('"') and len(param) >= 2:
+            param = re.sub(r'\\(.)', r'\1', param[1:-1])
+        params[name.lower()] = param
+    return main.strip().lower(), params
+
+
+def parse_boundary(content_type):
+    # 'multipart/form-data; boundary=raja' -> b"raja"
+    kind, params = _parse_params(content_type or "")
+    boundary = params.get("boundary")
+    if kind != "multipart/form-data" or not boundary or len(boundary) > 200:
+        raise FormError("invalid multipart boundary")
+    return boundary.encode("latin-1")
+
+
+class MultipartParser:
+    # parsii multipart/form-data-bodyn paloina: feed(data) niin monta kertaa kuin dataa tulee
+    # ja lopuksi close(), joka palauttaa FormDatan
+
+    def __init__(self, boundary, spool_size=SPOOL_SIZE, max_field_size=MAX_FIELD_SIZE, max_parts=MAX_PARTS,
+                 encoding="utf-8"):
+        self.delimiter = b"\r\n--" + boundary
+        self.spool_size = spool_size
+        self.max_field_size = max_field_size
+        self.max_parts = max_parts
+        self.encoding = encoding
+        self.form = FormData()
+        # ensimmäisen rajan edessä ei ole \r\n:ää, joten se lisätään puskurin alkuun
+        self._buffer = bytearray(b"\r\n")
+        # preamble -> (rajan jälkeen) separator -> headers -> body -> separator ... -> end
+        self._state = "preamble"
+        self._part = None
+        self._target = None
+        self._size = 0
+        self._parts = 0
+
+    def feed(self, data):
+        self._buffer += data
+        while self._step():
+            pass
+
+    def _step(self):
+        # käsittelee puskurista niin paljon kuin pystyy, palauttaa True, jos kannattaa jatkaa
+        buffer = self._buffer
+        if self._state in ("preamble", "body"):
+            index = buffer.find(self.delimiter)
+            if index == -1:
+                # puskurin lopussa voi olla rajan alku, joten sitä ei vielä kirjoiteta
+                keep = len(self.delimiter) - 1
+                if len(buffer) > keep:
+                    if self._state == "body":
+                        self._write(buffer[:len(buffer) - keep])
+                    del buffer[:len(buffer) - keep]
+                return False
+            if self._state == "body":
+                self._write(buffer[:index])
+                self._finish_part()
+            del buffer[:index + len(self.delimiter)]
+            self._state = "separator"
+            return True
+
+        if self._state == "separator":
+            # rajan jälkeen tulee \r\n (seuraava osa) tai -- (body loppui)
+            if len(buffer) < 2:
+                return False
+            if buffer[:2] == b"--":
+                self._state = "end"
+                buffer.clear()
+                return False
+            end = buffer.find(b"\r\n")
+            if end == -1:
+                return False
+            # rajan perässä saa olla välilyöntejä ennen rivinvaihtoa
+            if buffer[:end].strip(b" \t"):
+                raise FormError("malformed multipart boundary")
+            del buffer[:end + 2]
+            self._state = "headers"
+            return True
+
+        if self._state == "headers":
+            if len(buffer) < 2:
+                return False
+            # osalla ei välttämättä ole yhtään headeria: tyhjä rivi heti rajan jälkeen
+            if buffer[:2] == b"\r\n":
+                del buffer[:2]
+                self._start_part({})
+                self._state = "body"
+                return True
+            end = buffer.find(b"\r\n\r\n")
+            if end == -1:
+                if len(buffer) > MAX_PART_HEADER_SIZE:
+                    raise FormError("multipart part headers too large")
+                return False
+            headers = {}
+            for line in bytes(buffer[:end]).decode(self.encoding, "replace").split("\r\n"):
+                name, sep, value = line.partition(":")
+                if not sep:
+                    raise FormError("malformed multipart part header")
+                headers[name.strip().lower()] = value.strip()
+            del buffer[:end + 4]
+            self._start_part(headers)
+            self._state = "body"
+            return True
+
+        # end: loppu (epilogue) jätetään huomiotta
+        buffer.clear()
+        return False
+
+    def _start_part(self, headers):
+        self._parts += 1
+        if self._parts > self.max_parts:
+            raise FormError("too many multipart parts")
+        disposition, params = _parse_params(headers.get("content-disposition", ""))
+        if disposition != "form-data" or "name" not in params:
+            raise FormError("multipart part without a form-data name")
+        filename = params.get("filename")
+        if filename is not None:
+            # jotkin selaimet lähettävät koko polun (C:\kuvat\kuva.png)
+            filename = os.path.basename(filename.replace("\\", "/"))
+            self._target = tempfile.SpooledTemporaryFile(self.spool_size)
+        else:
+            self._target = bytearray()
+        self._part = (params["name"], filename, headers)
+        self._size = 0
+
+    def _write(self, data):
+        if not data:
+            return
+        self._size += len(data)
+        if isinstance(self._target, bytearray):
+            if self._size > self.max_field_size:
+                raise FormError("multipart field too large")
+            self._target += data
+        else:
+            self._target.write(data)
+
+    def _finish_part(self):
+        name, filename, headers = self._part
+        if filename is None:
+            self.form.fields.setdefault(name, []).append(self._target.decode(self.encoding, "replace"))
+        else:
+            self._target.seek(0)
+            upload = UploadedFile(name, filename, headers.get("content-type", "application/octet-stream"),
+                                  headers, self._target, self._size)
+            self.form.files.setdefault(name, []).append(upload)
+        self._part = None
+        self._target = None
+
+    def close(self):
+        # palauttaa FormDatan, kun koko body on syötetty
+        if self._state != "end":
+            self.abort()
+            raise FormError("truncated multipart body")
+        return self.form
+
+    def abort(self):
+        # virheen jälkeen jo luodut väliaikaistiedostot poistetaan
+        if self._target is not None and not isinstance(self._target, bytearray):
+            self._target.close()
+        self._target = None
+        self.form.close()
+
+
+def parse_form(request):
+    # palauttaa requestin lomakkeen FormDatana
+    # multipart-body on parsittu jo luettaessa (request.form),
+    # urlencoded-body parsitaan vasta nyt
+    if request.form is not None:
+        return request.form
+    content_type = request.headers.get("Content-Type", "")
+    if content_type.split(";", 1)[0].strip().lower() == "application/x-www-form-urlencoded":
+        request.form = FormData(parse_qs(request.body))
+    else:
+        request.form = FormData()
+    return request.form
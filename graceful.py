@@ -0,0 +1,165 @@
+# hallittu sammutus ja uudelleenlataus
+#
+# SIGTERM (ja Ctrl+C): serveri lakkaa hyväksymästä uusia yhteyksiä, käsittelee jo alkaneet
+# requestit loppuun ja sulkee keep-alive-yhteydet, jotka odottavat seuraavaa requestia
+# jos kaikki ei valmistu SHUTDOWN_TIMEOUT sekunnissa, loput yhteydet katkaistaan
+#
+# SIGHUP: serveri käynnistää itsestään uuden prosessin (python app.py ...), joka saa
+# kuuntelevan socketin perintönä (SERVER_LISTEN_FD), joten uudet yhteydet eivät katkea
+# eikä porttia tarvitse avata uudestaan. kun uusi prosessi ilmoittaa olevansa valmis,
+# vanha sammuu hallitusti kuten SIGTERMissä. näin uusi koodi ja templatet saadaan käyttöön
+# ilman katkoa:
+#
+#   kill -HUP <pid>
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+import access_log
+
+# kuinka monta sekuntia keskeneräisiä requesteja odotetaan sammutuksessa
+SHUTDOWN_TIMEOUT = 30
+# kuinka kauan uuden prosessin käynnistymistä odotetaan SIGHUPissa
+READY_TIMEOUT = 30
+
+LISTEN_FD_ENV = "SERVER_LISTEN_FD"
+READY_FD_ENV = "SERVER_READY_FD"
+
+
+class Drain:
+    # pitää kirjaa avoimista yhteyksistä, jotta sammutuksessa
+    # - seuraavaa requestia odottavat (idle) keep-alive-yhteydet voidaan herättää ja sulkea heti
+    # - aikarajan jälkeen kaikki loput yhteydet voidaan katkaista
+    # wake ja abort ovat funktioita, jotka herättävät yhteyttä käsittelevän säikeen tai taskin:
+    # wake antaa jo saapuneen datan vielä lukea (request, joka oli jo matkalla, käsitellään),
+    # abort katkaisee yhteyden heti
+
+    def __init__(self):
+        self.draining = False
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def add(self, connection, wake, abort):
+        with self._lock:
+            self._connections[connection] = [wake, abort, False]
+
+    def remove(self, connection):
+        with self._lock:
+            self._connections.pop(connection, None)
+
+    def idle(self, connection):
+        # yhteys odottaa seuraavaa requestia
+        # jos sammutus on jo alkanut, yhteys herätetään heti
+        with self._lock:
+            state = self._connections[connection]
+            state[2] = True
+            wake = state[0] if self.draining else None
+        if wake is not None:
+            _call(wake)
+
+    def busy(self, connection):
+        with self._lock:
+            state = self._connections.get(connection)
+            if state is not None:
+                state[2] = False
+
+    def start(self):
+        # sammutus alkaa: herätetään yhteydet, jotka eivät ole kesken requestin
+        with self._lock:
+            self.draining = True
+            idle = [wake for wake, _, is_idle in self._connections.values() if is_idle]
+        for wake in idle:
+            _call(wake)
+
+    def close_all(self):
+        # aikaraja ylittyi: katkaistaan kaikki yhteydet
+        with self._lock:
+            connections = [abort for _, abort, _ in self._connections.values()]
+        for abort in connections:
+            _call(abort)
+
+    def __len__(self):
+        return len(self._connections)
+
+
+def _call(close):
+    try:
+        close()
+    except OSError:
+        pass
+
+
+def socket_closers(client_socket):
+    # palauttaa (wake, abort) socketille
+    # shutdown() herättää recv()issä odottavan säikeen, close() ei sitä tekisi
+    # SHUT_RD: recv() palauttaa vielä jo saapuneen datan ja sen jälkeen b""
+    # SHUT_RDWR: yhteys katkaistaan kumpaankin suuntaan
+    # socket.socket.shutdown eikä client_socket.shutdown, koska SSLSocket.shutdown() poistaisi
+    # TLS-tilan kesken lähetyksen
+    return (lambda: socket.socket.shutdown(client_socket, socket.SHUT_RD),
+            lambda: socket.socket.shutdown(client_socket, socket.SHUT_RDWR))
+
+
+def inherited_socket():
+    # palauttaa edelliseltä prosessilta perityn kuuntelevan socketin tai None
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is None:
+        return None
+    return socket.socket(fileno=int(fd))
+
+
+def notify_ready():
+    # uusi prosessi kertoo vanhalle, että se hyväksyy nyt yhteyksiä
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+    except OSError:
+        pass
+    finally:
+        os.close(int(fd))
+
+
+def spawn_replacement(server_socket):
+    # käynnistää tästä prosessista uuden kopion samoilla komentoriviparametreilla
+    # ja antaa sille kuuntelevan socketin
+    # palauttaa tiedostokuvaajan, josta voi lukea b"1", kun uusi prosessi on valmis
+    # (tyhjä luku tarkoittaa, että uusi prosessi kaatui ennen kuin se ehti valmiiksi)
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ)
+    env[LISTEN_FD_ENV] = str(server_socket.fileno())
+    env[READY_FD_ENV] = str(write_fd)
+    try:
+        process = subprocess.Popen([sys.executable] + sys.argv, env=env,
+                                   pass_fds=(server_socket.fileno(), write_fd))
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    access_log.log.info(f"Started replacement process {process.pid}")
+    return read_fd
+
+
+def wait_ready(ready_fd, timeout=READY_TIMEOUT):
+    # odottaa uuden prosessin valmistumista, palauttaa True, jos se on valmis
+    try:
+        readable, _, _ = select.select([ready_fd], [], [], timeout)
+        return bool(readable) and os.read(ready_fd, 1) == b"1"
+    finally:
+        os.close(ready_fd)
+
+
+def install_signal_handlers(stop, reload=None):
+    # signaalikäsittelijät voi asettaa vain pääsäikeessä
+    if threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop())
+    if reload is not None and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload())
@@ -0,0 +1,212 @@
+# http-requestien parsiminen
+#
+# tcp ei tiedä mitään http-requesteista: yksi recv() voi palauttaa puolikkaan requestin
+# tai useamman requestin kerralla. siksi luetut tavut kerätään puskuriin (buffer)
+# ja requesti parsitaan vasta, kun puskurissa on koko headeriosa (päättyy \r\n\r\n)
+# ja Content-Lengthin verran bodya
+import forms
+
+# headeriosan (start line + headerit) maksimikoko tavuina
+MAX_HEADER_SIZE = 8192
+# bodyn maksimikoko tavuina
+MAX_BODY_SIZE = 1024 * 1024
+# multipart/form-data-bodyn (tiedostojen lähetys) oletusmaksimikoko routeille, jotka ottavat vastaan
+# tiedostoja (ks. router.Router.route). multipart-body ei jää muistiin kokonaisena, vaan se parsitaan
+# paloina (forms.MultipartParser). muille routeille body saa olla enintään MAX_BODY_SIZE
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+
+class HttpParseError(Exception):
+    # status on http-statuskoodi, jolla serveri vastaa virheelliseen requestiin
+    # esim. 400 Bad Request, 413 Content Too Large
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+
+class Request:
+    __slots__ = ("method", "path", "version", "headers", "body", "query", "route", "form")
+
+    def __init__(self, method, path, version, headers, body=b"", form=None):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        # router täyttää query stringin parametrit ja routen, johon request osui
+        self.query = {}
+        self.route = None
+        # forms.FormData: multipart-body parsitaan jo luettaessa, muuten forms.parse_form täyttää tämän
+        self.form = form
+
+    def __repr__(self):
+        return f"<Request {self.method} {self.path}>"
+
+
+# headerit, joita saa olla vain yksi: jos client lähettää saman headerin kahdesti eri arvoilla,
+# serveri ja sen edessä oleva proxy voivat tulkita requestin eri tavoin (request smuggling)
+SINGLE_HEADERS = frozenset(("Content-Length", "Host"))
+
+# headerien nimet eivät ole kirjainkoolle herkkiä, joten ne muutetaan muotoon
+# Content-Type riippumatta siitä, lähettikö client content-type vai CONTENT-TYPE
+_header_names = {}
+
+
+def _header_name(raw):
+    name = _header_names.get(raw)
+    if name is None:
+        name = "-".join(part.capitalize() for part in raw.decode("latin-1").strip().split("-"))
+        # ei anneta clientin kasvattaa välimuistia loputtomasti
+        if len(_header_names) < 1024:
+            _header_names[raw] = name
+    return name
+
+
+def parse_head(head):
+    # head on headeriosa tavuina ilman lopun \r\n\r\n:ää
+    """
+    GET / HTTP/1.1 (Start Line)
+    Accept: text/html
+    Content-Type: application/x-www-form-urlencoded
+    """
+    request_line, _, header_block = head.partition(b"\r\n")
+    # start line hajoitetaan välilyönneistä: 1. metodi, 2. path ja 3. HTTP-protokollaversio
+    parts = request_line.split(b" ")
+    if len(parts) != 3 or not parts[0].isalpha() or not parts[2].startswith(b"HTTP/"):
+        raise HttpParseError(400, "Bad Request")
+    method, path, version = (part.decode("latin-1") for part in parts)
+
+    headers = {}
+    if header_block:
+        for line in header_block.split(b"\r\n"):
+            # esim: Content-Type: application/json
+            key, sep, value = line.partition(b":")
+            if not sep or not key or key[-1:] in (b" ", b"\t"):
+                raise HttpParseError(400, "Bad Request")
+            name = _header_name(key)
+            value = value.strip().decode("latin-1")
+            if name in SINGLE_HEADERS and headers.get(name, value) != value:
+                raise HttpParseError(400, "Bad Request")
+            headers[name] = value
+    return method, path, version, headers
+
+
+class RequestParser:
+    # yhden tcp-yhteyden parseri: socketista luetut tavut annetaan feed()-metodille
+    # ja valmiit requestit haetaan next_request()-metodilla
+    # koska puskuri säilyy requestien välillä, samassa recv():ssä tulleet
+    # useammat requestit (pipelining) käsitellään järjestyksessä
+
+    def __init__(self, max_header_size=MAX_HEADER_SIZE, max_body_size=MAX_BODY_SIZE, upload_limit=None):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        # upload_limit(method, path): multipart-bodyn maksimikoko tälle routelle tai 0, jos route ei ota
+        # vastaan tiedostoja (esim. router.Router.upload_limit). se kysytään ennen kuin bodya luetaan,
+        # jotta 404- ja 405-requestien tiedostoja ei lueta väliaikaistiedostoihin
+        self.upload_limit = upload_limit
+        self.buffer = bytearray()
+        # True, kun client odottaa "100 Continue" -vastausta ennen bodyn lähettämistä
+        self.expects_continue = False
+        # parsittu headeriosa, jonka bodya vielä odotetaan
+        self._pending = None
+        self._content_length = 0
+        # forms.MultipartParser, jos bodya parsitaan paloina
+        self._multipart = None
+        # mistä kohtaa puskuria \r\n\r\n:ää etsitään, jotta samoja tavuja ei käydä läpi uudestaan
+        self._scan_from = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    @property
+    def idle(self):
+        # True, kun edellinen request on käsitelty eikä seuraavasta ole vielä tullut yhtään tavua
+        return not self.buffer and self._pending is None
+
+    @property
+    def reading_body(self):
+        # True, kun headerit on luettu ja bodya odotetaan
+        return self._pending is not None
+
+    def next_request(self):
+        # palauttaa seuraavan valmiin requestin tai None, jos puskurissa ei vielä ole kokonaista requestia
+        if self._pending is None:
+            end = self.buffer.find(b"\r\n\r\n", self._scan_from)
+            if end == -1:
+                if len(self.buffer) > self.max_header_size:
+                    raise HttpParseError(431, "Request Header Fields Too Large")
+                self._scan_from = max(0, len(self.buffer) - 3)
+                return None
+            if end > self.max_header_size:
+                raise HttpParseError(431, "Request Header Fields Too Large")
+
+            method, path, version, headers = parse_head(bytes(self.buffer[:end]))
+            del self.buffer[:end + 4]
+            self._scan_from = 0
+
+            if "Transfer-Encoding" in headers:
+                # chunked-muotoista request bodya ei tueta
+                raise HttpParseError(411, "Length Required")
+            # pelkkiä numeroita: int() hyväksyisi myös esim. "+5", " 5" ja "1_0"
+            content_length = headers.get("Content-Length", "0")
+            if not (content_length.isascii() and content_length.isdigit()):
+                raise HttpParseError(400, "Bad Request")
+            content_length = int(content_length)
+            content_type = headers.get("Content-Type", "")
+            max_upload_size = 0
+            if (content_length and self.upload_limit is not None
+                    and content_type[:19].lower() == "multipart/form-data"):
+                max_upload_size = self.upload_limit(method, path)
+            if max_upload_size:
+                if content_length > max_upload_size:
+                    raise HttpParseError(413, "Content Too Large")
+                try:
+                    self._multipart = forms.MultipartParser(forms.parse_boundary(content_type))
+                except forms.FormError:
+                    raise HttpParseError(400, "Bad Request")
+            elif content_length > self.max_body_size:
+                raise HttpParseError(413, "Content Too Large")
+
+            self._pending = (method, path, version, headers)
+            self._content_length = content_length
+            self.expects_continue = (content_length > len(self.buffer)
+                                     and headers.get("Expect", "").lower() == "100-continue")
+
+        if self._multipart is not None:
+            return self._next_multipart()
+
+        if len(self.buffer) < self._content_length:
+            return None
+
+        # luetaan bodysta tasan Content-Lengthin verran tavuja
+        # loput puskurista kuuluu seuraavalle requestille
+        body = bytes(self.buffer[:self._content_length])
+        del self.buffer[:self._content_length]
+        method, path, version, headers = self._pending
+        self._pending = None
+        self.expects_continue = False
+        return Request(method, path, version, headers, body)
+
+    def _next_multipart(self):
+        # multipart-body syötetään MultipartParserille sitä mukaa kun sitä tulee,
+        # joten puskuriin ei koskaan kerry koko bodya
+        multipart = self._multipart
+        size = min(len(self.buffer), self._content_length)
+        try:
+            if size:
+                multipart.feed(bytes(self.buffer[:size]))
+                del self.buffer[:size]
+                self._content_length -= size
+            if self._content_length:
+                return None
+            form = multipart.close()
+        except forms.FormError:
+            multipart.abort()
+            self._multipart = None
+            raise HttpParseError(400, "Bad Request")
+        method, path, version, headers = self._pending
+        self._pending = None
+        self._multipart = None
+        self.expects_continue = False
+        return Request(method, path, version, headers, form=form)
@@ -0,0 +1,870 @@
+# yhteiset apufunktiot esimerkkiservereille
+import argparse
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+
+import select
+
+import access_log
+import compression
+import graceful
+import http_parser
+import limits
+import metrics
+import profiler
+import tls
+
+# kuinka monta requestia samalla tcp-yhteydellä saa käsitellä ennen kuin yhteys suljetaan
+MAX_REQUESTS_PER_CONNECTION = 100
+
+# kuinka monta säiettä (thread) käsittelee yhteyksiä
+WORKERS = 32
+# kuinka monta hyväksyttyä yhteyttä saa odottaa vapaata säiettä
+QUEUE_SIZE = 64
+# kuinka monta yhteyttä käyttöjärjestelmä pitää jonossa ennen kuin serveri hyväksyy ne (accept)
+BACKLOG = 128
+# kuinka monen sekunnin päästä ylikuormitettua serveriä kannattaa yrittää uudelleen
+RETRY_AFTER = 1
+# Server-header
+SERVER_NAME = "tcp_server"
+# Responsen oletusheaderit
+HTML = (("Content-Type", "text/html; charset=utf-8"),)
+
+
+class BaseResponse:
+    # kaikkien responsejen yhteinen osa: status ja headerit tuple-pareina
+    # (("Content-Type", "text/html"), ("Cache-Control", "no-cache"))
+    # head() muuttaa ne tavuiksi aina samalla tavalla, ja Date, Server, Connection ja bodyn pituus
+    # (Content-Length tai Transfer-Encoding) lisätään automaattisesti lähetettäessä
+    # jokaisella aliluokalla on with_headers(headers): kopio, jonka headerien perään on lisätty headers
+    # (alkuperäistä ei muuteta, koska handler voi palauttaa saman olion useammalle requestille)
+    __slots__ = ("status", "headers")
+
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = HTML if headers is None else tuple(headers)
+
+    def header(self, name):
+        name = name.lower()
+        for header_name, value in self.headers:
+            if header_name.lower() == name:
+                return value
+        return None
+
+
+class Response(BaseResponse):
+    # response, jonka body on valmiina tavuina
+    #
+    #   return http_server.Response("<h1>Hello</h1>")
+    #   return http_server.Response(body, 201, HTML + (("Location", "/users/1"),))
+    __slots__ = ("body",)
+
+    def __init__(self, body=b"", status=200, headers=None):
+        super().__init__(status, headers)
+        self.body = body.encode() if isinstance(body, str) else body
+
+    def head(self, keep_alive=False):
+        return serialize_head(self.status, self.headers, content_length(self.status, len(self.body)), keep_alive)
+
+    def with_headers(self, headers):
+        return Response(self.body, self.status, self.headers + tuple(headers))
+
+
+class StreamingResponse(BaseResponse):
+    # response, jonka body lähetetään clientille paloina sitä mukaa kun palat valmistuvat
+    # chunks on iteraattori (esim. generaattori), joka tuottaa bodyn merkkijonoina tai tavuina
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks, status=200, headers=None):
+        super().__init__(status, headers)
+        self.chunks = chunks
+
+    def head(self, keep_alive=False, chunked=True):
+        # HTTP/1.0 ei tunne chunked-koodausta (chunked=False): bodyn loppu ilmaistaan sulkemalla yhteys
+        return serialize_head(self.status, self.headers, CHUNKED_HEADER if chunked else b"", keep_alive)
+
+    def with_headers(self, headers):
+        return StreamingResponse(self.chunks, self.status, self.headers + tuple(headers))
+
+
+class FileResponse(BaseResponse):
+    # response, jonka body on tiedosto (tai sen osa offset..offset+count)
+    # Content-Length on count, tiedosto suljetaan, kun response on lähetetty
+    __slots__ = ("file", "offset", "count")
+
+    def __init__(self, file, offset, count, status=200, headers=None):
+        super().__init__(status, headers)
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def head(self, keep_alive=False):
+        return serialize_head(self.status, self.headers, content_length(self.status, self.count), keep_alive)
+
+    def with_headers(self, headers):
+        return FileResponse(self.file, self.offset, self.count, self.status, self.headers + tuple(headers))
+
+
+class BufferResponse(BaseResponse):
+    # response, jonka body on valmiiksi tavuiksi muutettujen palojen lista
+    # (esim. template_loader.render_bytes), Content-Length lasketaan palojen pituuksista
+    # palat lähetetään yhdellä sendmsg()-kutsulla (scatter-gather) ilman, että niitä
+    # yhdistetään ensin yhdeksi isoksi tavujonoksi
+    __slots__ = ("buffers",)
+
+    def __init__(self, buffers, status=200, headers=None):
+        super().__init__(status, headers)
+        self.buffers = buffers
+
+    def head(self, keep_alive=False):
+        length = sum(map(len, self.buffers))
+        return serialize_head(self.status, self.headers, content_length(self.status, length), keep_alive)
+
+    def with_headers(self, headers):
+        return BufferResponse(self.buffers, self.status, self.headers + tuple(headers))
+
+
+# status linet tavuina: {200: b"HTTP/1.1 200 OK\r\n", 404: b"HTTP/1.1 404 Not Found\r\n", ...}
+STATUS_LINES = {status.value: f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode() for status in HTTPStatus}
+SERVER_HEADER = f"Server: {SERVER_NAME}\r\n".encode()
+CHUNKED_HEADER = b"Transfer-Encoding: chunked\r\n"
+# headerit päättävä tyhjä rivi on mukana
+CONNECTION_HEADERS = {True: b"Connection: keep-alive\r\n\r\n", False: b"Connection: close\r\n\r\n"}
+# näillä statuksilla ei ole bodya, joten niille ei lähetetä Content-Lengthiä
+# (304:n Content-Length tarkoittaisi sen responsen pituutta, jota client ei saanut uudestaan)
+NO_BODY_STATUSES = frozenset((204, 304))
+# headerit, jotka head() lisää itse: merkkijonoresponsen vastaavat headerit jätetään pois (ks. as_response)
+AUTOMATIC_HEADERS = frozenset(("content-length", "transfer-encoding", "connection", "date", "server"))
+
+# samat headerit (esim. HTML) muutetaan tavuiksi vain kerran ja tulos muistetaan
+MAX_HEADER_BLOCKS = 1024
+_header_blocks = {}
+
+
+def header_block(headers):
+    # (("Content-Type", "text/html"),) -> b"Content-Type: text/html\r\n"
+    block = _header_blocks.get(headers)
+    if block is None:
+        block = "".join(f"{name}: {value}\r\n" for name, value in headers).encode("latin-1")
+        if len(_header_blocks) < MAX_HEADER_BLOCKS:
+            _header_blocks[headers] = block
+    return block
+
+
+# (sekunti, b"Date: ...\r\n")
+_date = (0, b"")
+
+
+def date_header():
+    # Date-header muuttuu vain kerran sekunnissa, joten se muodostetaan uudestaan korkeintaan kerran sekunnissa
+    # (tuplen sijoitus on atominen, joten lukkoa ei tarvita)
+    global _date
+    now = int(time.time())
+    second, header = _date
+    if second != now:
+        header = f"Date: {formatdate(now, usegmt=True)}\r\n".encode()
+        _date = (now, header)
+    return header
+
+
+def content_length(status, length):
+    if status in NO_BODY_STATUSES:
+        return b""
+    return b"Content-Length: %d\r\n" % length
+
+
+def serialize_head(status, headers, length_header, keep_alive):
+    # status line ja headerit tavuina, lähes kaikki osat ovat valmiita tavujonoja
+    # length_header: content_length(), CHUNKED_HEADER tai b""
+    status_line = STATUS_LINES.get(status)
+    if status_line is None:
+        status_line = f"HTTP/1.1 {status} Unknown\r\n".encode()
+    return b"".join((status_line, header_block(headers), date_header(), SERVER_HEADER, length_header,
+                     CONNECTION_HEADERS[keep_alive]))
+
+
+# kuinka monta palaa sendmsg() voi lähettää kerralla (Linuxissa 1024)
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def error_response(status, reason, headers=()):
+    # headers: lisäheaderit, esim. (("Allow", "GET, POST"),)
+    return Response(f"<html><body><h1>{reason}</h1></body></html>", status, HTML + tuple(headers))
+
+
+def as_response(response):
+    # handle_request voi palauttaa myös valmiin merkkijonon (tai tavut) muodossa
+    # "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html>...", joka muutetaan tässä Responseksi,
+    # jotta muun koodin (pakkaus, lähetys, mittarit) tarvitsee tuntea vain yksi muoto
+    if isinstance(response, BaseResponse):
+        return response
+    if isinstance(response, str):
+        response = response.encode()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *lines = head.decode("latin-1").split("\r\n")
+    # "HTTP/1.1 200 OK" -> 200
+    status = int(status_line[9:12])
+    headers = []
+    for line in lines:
+        name, _, value = line.partition(":")
+        name = name.strip()
+        if name and name.lower() not in AUTOMATIC_HEADERS:
+            headers.append((name, value.strip()))
+    return Response(body, status, headers)
+
+
+def wants_keep_alive(version, headers):
+    # HTTP/1.1:ssä yhteys pysyy oletuksena auki, ellei client lähetä Connection: close
+    # HTTP/1.0:ssa yhteys suljetaan oletuksena, ellei client lähetä Connection: keep-alive
+    connection = headers.get("Connection", "").lower()
+    if version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+
+def iter_chunked(response, keep_alive):
+    # Transfer-Encoding: chunked tarkoittaa, että bodyn pituutta ei kerrota etukäteen (ei Content-Lengthiä)
+    # vaan jokaisen palan eteen kirjoitetaan sen pituus heksalukuna:
+
+    """
+    HTTP/1.1 200 OK
+    Transfer-Encoding: chunked
+
+    5\r\n
+    Hello\r\n
+    0\r\n       (0-pituinen pala kertoo, että body loppui)
+    \r\n
+    """
+    # headerit lähetetään vasta ensimmäisen palan kanssa samassa tcp-segmentissä
+    head = response.head(keep_alive)
+    for chunk in response.chunks:
+        data = chunk.encode() if isinstance(chunk, str) else chunk
+        # tyhjää palaa ei saa lähettää kesken, koska se lopettaisi bodyn
+        if data:
+            data = b"%x\r\n%b\r\n" % (len(data), data)
+            if head is not None:
+                data = head + data
+                head = None
+            yield data
+    yield b"0\r\n\r\n" if head is None else head + b"0\r\n\r\n"
+
+
+def read_file(response, size=65536):
+    # FileResponsen tiedosto paloina, jos sendfile() ei ole käytettävissä
+    response.file.seek(response.offset)
+    remaining = response.count
+    while remaining > 0:
+        data = response.file.read(min(remaining, size))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def iter_response(response, keep_alive=False, version="HTTP/1.1"):
+    # muuttaa responsen lähetettäviksi tavupaloiksi: ensin headerit (head()), sitten body
+    if isinstance(response, StreamingResponse):
+        if version == "HTTP/1.1":
+            yield from iter_chunked(response, keep_alive)
+        else:
+            # HTTP/1.0 ei tunne chunked-koodausta, joten body lähetetään sellaisenaan
+            # ja sen loppu ilmaistaan sulkemalla yhteys
+            yield response.head(False, chunked=False)
+            for chunk in response.chunks:
+                yield chunk.encode() if isinstance(chunk, str) else chunk
+        return
+
+    yield response.head(keep_alive)
+    if isinstance(response, Response):
+        yield response.body
+    elif isinstance(response, BufferResponse):
+        yield from response.buffers
+    else:
+        try:
+            yield from read_file(response)
+        finally:
+            response.file.close()
+
+
+def sendall(client_socket, data, deadline=None):
+    # kuten socket.sendall(), mutta kaikilla send()-kutsuilla on yhteinen aikaraja (limits.WriteDeadline)
+    # palauttaa lähetettyjen tavujen määrän
+    view = memoryview(data)
+    while view:
+        if deadline is not None:
+            deadline.settimeout(client_socket)
+        sent = client_socket.send(view)
+        if deadline is not None:
+            deadline.sent(sent)
+        view = view[sent:]
+    return len(data)
+
+
+def send_buffers(client_socket, buffers, deadline=None):
+    # lähettää palat sendmsg()illa, enintään IOV_MAX palaa kerrallaan
+    # sendmsg() voi lähettää vain osan datasta, jolloin jatketaan siitä mihin jäätiin
+    # palauttaa lähetettyjen tavujen määrän
+    buffers = [buffer for buffer in buffers if buffer]
+    total = sum(map(len, buffers))
+    if isinstance(client_socket, ssl.SSLSocket) or not hasattr(client_socket, "sendmsg"):
+        # SSLSocketilla ei ole sendmsg()iä: salaus kopioi datan joka tapauksessa,
+        # joten palat yhdistetään ja lähetetään yhtenä
+        return sendall(client_socket, b"".join(buffers), deadline)
+    index = 0
+    while index < len(buffers):
+        if deadline is not None:
+            deadline.settimeout(client_socket)
+        sent = client_socket.sendmsg(buffers[index:index + IOV_MAX])
+        if deadline is not None:
+            deadline.sent(sent)
+        while sent:
+            size = len(buffers[index])
+            if sent >= size:
+                sent -= size
+                index += 1
+            else:
+                # memoryview ei kopioi jäljellä olevaa osaa
+                buffers[index] = memoryview(buffers[index])[sent:]
+                sent = 0
+    return total
+
+
+# os.sendfile() ja select.poll() ovat käytettävissä vain Unixissa
+ZERO_COPY = hasattr(os, "sendfile") and hasattr(select, "poll")
+
+
+def _sendfile(client_socket, response, deadline):
+    # sendfile() kopioi tiedoston suoraan käyttöjärjestelmän välimuistista socketiin
+    # socket.sendfile() antaisi jokaiselle odotukselle koko timeoutin, joten silmukka on tässä,
+    # ja odotus (poll) saa vain lähetyksen aikarajaan jäljellä olevan ajan
+    poller = select.poll()
+    poller.register(client_socket, select.POLLOUT)
+    offset, remaining = response.offset, response.count
+    while remaining > 0:
+        try:
+            sent = os.sendfile(client_socket.fileno(), response.file.fileno(), offset, remaining)
+        except BlockingIOError:
+            # lähetyspuskuri on täynnä: odotetaan, että client lukee dataa
+            timeout = None
+            if deadline is not None:
+                timeout = deadline.remaining()
+                if timeout <= 0:
+                    raise socket.timeout
+            if not poller.poll(None if timeout is None else timeout * 1000):
+                raise socket.timeout
+            continue
+        if sent == 0:
+            # tiedosto lyheni lähetyksen aikana
+            break
+        if deadline is not None:
+            deadline.sent(sent)
+        offset += sent
+        remaining -= sent
+    return response.count - remaining
+
+
+def send_file(client_socket, response, keep_alive=False, deadline=None):
+    try:
+        sent = sendall(client_socket, response.head(keep_alive), deadline)
+        if ZERO_COPY and not isinstance(client_socket, ssl.SSLSocket):
+            return sent + _sendfile(client_socket, response, deadline)
+        # TLS salaa datan pythonissa, joten tiedosto luetaan ja lähetetään paloina
+        for data in read_file(response):
+            sent += sendall(client_socket, data, deadline)
+        return sent
+    finally:
+        response.file.close()
+
+
+def send_response(client_socket, response, keep_alive=False, version="HTTP/1.1", deadline=None):
+    # palauttaa lähetettyjen tavujen määrän
+    # deadline (limits.WriteDeadline): koko responsen lähettämisen aikaraja
+    if isinstance(response, FileResponse):
+        return send_file(client_socket, response, keep_alive, deadline)
+    if isinstance(response, StreamingResponse):
+        sent = 0
+        for data in iter_response(response, keep_alive, version):
+            sent += sendall(client_socket, data, deadline)
+        return sent
+    # Responsen ja BufferResponsen headerit ja body lähetetään yhdellä sendmsg()-kutsulla
+    # ilman, että niitä yhdistetään
+    return send_buffers(client_socket, list(iter_response(response, keep_alive)), deadline)
+
+
+def set_nodelay(client_socket):
+    # TCP_NODELAY: pienet palat (esim. StreamingResponsen palat ja chunked-muodon lopetus) lähetetään
+    # heti. muuten Naglen algoritmi odottaisi edellisen segmentin kuittausta, jota client viivyttää
+    # (delayed ACK), ja jokainen keep-alive-yhteyden StreamingResponse jäisi odottamaan ~40 ms
+    try:
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+class Exchange:
+    # yksi request ja sen response
+    # threaded-serveri (handle_connection) ja asyncio-serveri (async_server.handle_connection) eroavat
+    # vain siinä, miten ne lukevat requestin ja lähettävät responsen, joten kaikki muu on täällä:
+    #   exchange = Exchange(request, remote, parse_time, keep_alive)
+    #   response = exchange.respond(handle_request, connection_limits, drain)
+    #   ... response lähetetään ...
+    #   exchange.finish(sent)
+    __slots__ = ("request", "remote", "parse_time", "keep_alive", "status", "started", "tracing",
+                 "handler_done", "handled_at")
+
+    def __init__(self, request, remote, parse_time, keep_alive):
+        self.request = request
+        self.remote = remote
+        self.parse_time = parse_time
+        self.keep_alive = keep_alive
+        self.status = None
+        self.started = time.perf_counter()
+        # hitaiden requestien lokitus (ks. profiler.py), 0 = ei käytössä
+        self.tracing = profiler.slow_request
+        if self.tracing:
+            profiler.begin()
+        self.handler_done = self.handled_at = self.started
+
+    def respond(self, handle_request, connection_limits, drain=None):
+        # palauttaa lähetettävän responsen ja päättää, jääkö yhteys auki (self.keep_alive)
+        request = self.request
+        retry_after = connection_limits.allow(self.remote)
+        if retry_after:
+            # ip on ylittänyt requestien määrän rajan (token bucket)
+            response = limits.too_many_requests(retry_after)
+        else:
+            # kun requestin osat on käsitelty
+            # kutsutaan funktiota, joka käsittelee reqeustin
+            # handle_request päättelee metodista, pathista, headerista ja reqeust-bodysta
+            # mikä response pitää palauttaa
+            # handle_request voi palauttaa myös valmiin merkkijonon, joka muutetaan Responseksi
+            response = as_response(handle_request(request.method, request.path, request.headers, request))
+        self.handler_done = time.perf_counter()
+        # pakataan response (gzip), jos client hyväksyy sen (Accept-Encoding)
+        response = compression.compress_response(request.headers, response)
+        self.handled_at = time.perf_counter()
+        if drain is not None and drain.draining:
+            # sammutus alkoi requestin käsittelyn aikana: tämä on yhteyden viimeinen response
+            self.keep_alive = False
+        if isinstance(response, StreamingResponse) and request.version != "HTTP/1.1":
+            # HTTP/1.0:ssa StreamingResponsen loppu ilmaistaan sulkemalla yhteys (ks. iter_response)
+            self.keep_alive = False
+        self.status = response.status
+        return response
+
+    def finish(self, sent):
+        # kutsutaan, kun response on lähetetty (sent tavua): loki, mittarit ja väliaikaistiedostot
+        request = self.request
+        finished = time.perf_counter()
+        started, handled_at = self.started, self.handled_at
+        access_log.log.access(self.remote, request.method, request.path, request.version,
+                              self.status, sent, finished - started)
+        metrics.record_request(request.route or "-", request.method, self.status,
+                               self.parse_time, handled_at - started, finished - handled_at, sent)
+        if self.tracing:
+            profiler.finish(request.method, request.path, self.status, self.parse_time + finished - started,
+                            (("parse", self.parse_time), ("handler", self.handler_done - started),
+                             ("compress", handled_at - self.handler_done), ("send", finished - handled_at)))
+        if request.form is not None:
+            # poistetaan lähetettyjen tiedostojen väliaikaistiedostot
+            request.form.close()
+
+
+def handle_connection(client_socket, handle_request, connection_limits=None,
+                      max_requests=MAX_REQUESTS_PER_CONNECTION,
+                      max_header_size=http_parser.MAX_HEADER_SIZE, max_body_size=http_parser.MAX_BODY_SIZE,
+                      drain=None, upload_limit=None):
+    # HTTP/1.1:ssä tcp-yhteys pidetään auki useamman http-pyynnön ajan (keep-alive),
+    # koska tcp-yhteyden avaaminen vie aikaa
+    # yhteys suljetaan, kun
+    # - client pyytää sitä (Connection: close)
+    # - client ei lähetä uutta requestia idle_timeoutin kuluessa tai requestin lukeminen tai
+    #   responsen lähettäminen ylittää aikarajansa (ks. limits.py)
+    # - samalla yhteydellä on käsitelty max_requests requestia
+    # - serveriä ollaan sammuttamassa (drain, ks. graceful.py)
+    if connection_limits is None:
+        connection_limits = limits.Limits()
+    deadline = limits.ReadDeadline(connection_limits)
+    # upload_limit: routekohtainen multipart-bodyn maksimikoko (esim. router.upload_limit, ks. router.py)
+    parser = http_parser.RequestParser(max_header_size, max_body_size, upload_limit)
+    handled = 0
+    try:
+        remote = client_socket.getpeername()[0]
+    except OSError:
+        remote = "-"
+    set_nodelay(client_socket)
+    metrics.inc("http_active_connections")
+    if drain is not None:
+        drain.add(client_socket, *graceful.socket_closers(client_socket))
+    try:
+        while handled < max_requests:
+            try:
+                # luetaan socketista, kunnes parserilla on kokonainen request
+                # pipelinatut requestit voivat olla jo puskurissa, jolloin recv():tä ei tarvita
+                # parse_time mittaa vain parserin käyttämän ajan, ei recv():n odottelua
+                parse_started = time.perf_counter()
+                request = parser.next_request()
+                parse_time = time.perf_counter() - parse_started
+                while request is None:
+                    if parser.expects_continue:
+                        # client odottaa lupaa ennen kuin lähettää ison bodyn
+                        client_socket.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+                        parser.expects_continue = False
+                    if drain is not None and parser.idle:
+                        # jos sammutus on alkanut, recv() palauttaa vain jo saapuneen datan
+                        drain.idle(client_socket)
+                    # aikaraja lasketaan joka kerta uudestaan: headereille ja bodylle on
+                    # kokonaisaikaraja, joten jokainen recv() saa vain jäljellä olevan ajan
+                    timeout = deadline.timeout(parser)
+                    if timeout <= 0:
+                        raise socket.timeout
+                    client_socket.settimeout(timeout)
+                    data = client_socket.recv(65536)
+                    if not data:
+                        # client sulki yhteyden
+                        return
+                    if drain is not None:
+                        drain.busy(client_socket)
+                    metrics.inc("http_bytes_received_total", len(data))
+                    parse_started = time.perf_counter()
+                    parser.feed(data)
+                    request = parser.next_request()
+                    parse_time += time.perf_counter() - parse_started
+            except http_parser.HttpParseError as e:
+                # virheellisen requestin jälkeen puskurin sisällöstä ei voi tietää, missä
+                # seuraava request alkaa, joten vastataan virheellä ja suljetaan yhteys
+                send_response(client_socket, error_response(e.status, e.reason),
+                              deadline=limits.WriteDeadline(connection_limits.write_timeout))
+                return
+            except socket.timeout:
+                # odottava keep-alive-yhteys suljetaan hiljaa, kesken jäänyt request saa 408:n
+                if deadline.expired():
+                    send_response(client_socket, error_response(408, "Request Timeout"),
+                                  deadline=limits.WriteDeadline(connection_limits.write_timeout))
+                return
+            deadline.reset()
+
+            handled += 1
+            exchange = Exchange(request, remote, parse_time,
+                                wants_keep_alive(request.version, request.headers) and handled < max_requests)
+            response = exchange.respond(handle_request, connection_limits, drain)
+            # läheteään response clientille takaisin
+            # koko responsen lähettämisellä on yksi aikaraja (ks. limits.WriteDeadline)
+            sent = send_response(client_socket, response, exchange.keep_alive, request.version,
+                                 limits.WriteDeadline(connection_limits.write_timeout))
+            exchange.finish(sent)
+            if not exchange.keep_alive:
+                break
+    except socket.timeout:
+        # client ei lukenut responsea ajoissa
+        metrics.inc("http_timeouts_total", labels=(("phase", "write"),))
+    except Exception as e:
+        access_log.log.error(f"Error handling client: {e}")
+    finally:
+        metrics.inc("http_active_connections", -1)
+        if drain is not None:
+            drain.remove(client_socket)
+        client_socket.close()
+        access_log.log.debug("Client disconnected.")
+
+
+class WorkerPool:
+    # kiinteä määrä säikeitä, jotka ottavat yhteyksiä jonosta ja käsittelevät ne
+    # aiemmin jokaiselle yhteydelle käynnistettiin oma säie, jolloin iso määrä
+    # yhtäaikaisia yhteyksiä loi yhtä monta säiettä ja söi muistin
+    # huom: keep-alive-yhteys varaa säikeen niin pitkäksi aikaa kuin se on auki
+
+    def __init__(self, handle_client, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self.handle_client = handle_client
+        self.queue = queue.Queue(queue_size)
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            client = self.queue.get()
+            # None on merkki siitä, että säikeen pitää lopettaa
+            if client is None:
+                return
+            self.handle_client(client)
+
+    def submit(self, client, block=False, timeout=None):
+        # palauttaa False, jos jono on täynnä
+        try:
+            self.queue.put(client, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def shutdown(self, timeout=None):
+        # säikeet käsittelevät jonossa olevat yhteydet loppuun ennen kuin ne lopettavat
+        # palauttaa False, jos kaikki säikeet eivät lopettaneet timeout sekunnissa
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self.threads:
+            # jos jono on täynnä, lopetusmerkki odottaa tilaa vain deadlineen asti
+            try:
+                self.queue.put(None, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+
+def overloaded_response(status="503 Service Unavailable"):
+    # Retry-After kertoo, kuinka monen sekunnin kuluttua kannattaa yrittää uudelleen
+    return (f"HTTP/1.1 {status}\r\nRetry-After: {RETRY_AFTER}\r\n"
+            f"Content-Length: 0\r\nConnection: close\r\n\r\n").encode()
+
+
+def reject_overloaded(client_socket, status="503 Service Unavailable"):
+    # jos kaikki säikeet ovat varattuja ja jono on täynnä, vastataan heti
+    # 503 Service Unavailable, jotta client ei jää odottamaan turhaan
+    # (samoin 429 Too Many Requests, jos clientin ip:llä on jo liikaa yhteyksiä)
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(overloaded_response(status))
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+
+def create_server_socket(host, port, backlog=BACKLOG):
+    # tämä rivi luo tcp-serverin
+    # AF_INET tarkoittaa, että tcp-serveri käyttää IP versio 4. (192.168.1.1)-tyylistä osoitetta
+    # SOCK_STREAM tarkoittaa, että serveri käyttää TCP-protokollaa
+    # DGRAM käyttäisi UDP:tä (User DataGram Protocol)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # SO_REUSEADDR sallii serverin uudelleenkäynnistyksen samaan porttiin heti,
+    # vaikka edellisen serverin yhteydet olisivat vielä TIME_WAIT-tilassa
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # kiinitetään tcp-palvelin haluttuun ip-osoitteeseen ja porttiin
+    server_socket.bind((host, port))
+    # laitetaan severi päälle
+    # backlog määrittelee pendaavien yhteyksien määrän
+
+    # pendaava yhteys? pendaava yhteys on yhteys, jonka
+    # asiakas on, mutta, jota serveri ei  vielä ole hyväksynyt
+    server_socket.listen(backlog)
+    return server_socket
+
+
+def serve_forever(server_socket, handle_request, workers=WORKERS, queue_size=QUEUE_SIZE, overload="reject",
+                  stop_event=None, reload_event=None, shutdown_timeout=graceful.SHUTDOWN_TIMEOUT,
+                  connection_limits=None, ssl_context=None, upload_limit=None):
+    # hyväksyy yhteyksiä, kunnes stop_event asetetaan (SIGTERM, Ctrl+C)
+    # lopuksi odotetaan enintään shutdown_timeout sekuntia, että säikeet ovat käsitelleet
+    # jo hyväksytyt yhteydet, ja katkaistaan loput
+    # reload_event (SIGHUP) käynnistää uuden prosessin, joka perii server_socketin,
+    # ja kun se on valmis, tämä prosessi sammuu kuten stop_eventissä
+    if stop_event is None:
+        stop_event = threading.Event()
+    # connection_limits: aikarajat ja clienttikohtaiset rajat (ks. limits.py)
+    # ssl_context: HTTPS, jos annettu (ks. tls.py)
+    if connection_limits is None:
+        connection_limits = limits.Limits()
+    drain = graceful.Drain()
+
+    def handle_client(client):
+        client_socket, ip = client
+        try:
+            if ssl_context is not None:
+                # TLS-kättely tehdään worker-säikeessä, jotta hidas client ei jumita accept-luuppia
+                client_socket = tls.handshake(ssl_context, client_socket, connection_limits.header_timeout)
+                if client_socket is None:
+                    return
+            handle_connection(client_socket, handle_request, connection_limits, drain=drain,
+                              upload_limit=upload_limit)
+        finally:
+            connection_limits.release(ip)
+
+    pool = WorkerPool(handle_client, workers, queue_size)
+    ready_fd = None
+    ready_deadline = 0
+    try:
+        # pyöritetään luuppia, jotta serveri pysyy päällä
+        while not stop_event.is_set():
+            if reload_event is not None and reload_event.is_set() and ready_fd is None:
+                reload_event.clear()
+                try:
+                    ready_fd = graceful.spawn_replacement(server_socket)
+                    # jos uusi prosessi jumittuu käynnistyessään, sitä ei odoteta loputtomiin,
+                    # koska siihen asti uudet SIGHUPit jätetään huomiotta
+                    ready_deadline = time.monotonic() + graceful.READY_TIMEOUT
+                except OSError as e:
+                    access_log.log.error(f"Reload failed: {e}")
+
+            # mihin select()iä tarvitaan? tcp-serveri toimii ilman selectiäkin hyvin,
+            # mutta sitä ei voisi sammuttaa ilman selectiä,
+            watched = [server_socket] if ready_fd is None else [server_socket, ready_fd]
+            try:
+                ready_to_read, _, _ = select.select(watched, [], [], 1)
+            except InterruptedError:
+                continue
+
+            if ready_fd is not None and ready_fd in ready_to_read:
+                # uusi prosessi on valmis (b"1") tai kaatui (b"")
+                ready = os.read(ready_fd, 1) == b"1"
+                os.close(ready_fd)
+                ready_fd = None
+                if ready:
+                    access_log.log.info("# Replacement process is ready. Shutting down. #")
+                    break
+                access_log.log.error("Replacement process exited before it was ready, keeping this one")
+            elif ready_fd is not None and time.monotonic() > ready_deadline:
+                os.close(ready_fd)
+                ready_fd = None
+                access_log.log.error(f"Replacement process was not ready in {graceful.READY_TIMEOUT}s, "
+                                     "keeping this one")
+
+            # tänne mennään, jos serverille tulee uusia pyyntöjä
+            if server_socket in ready_to_read:
+                try:
+                    # serveri hyväksyy clientin yhteydenoton
+                    client_socket, addr = server_socket.accept()
+                except BlockingIOError:
+                    # toinen prosessi ehti hyväksyä yhteyden ensin (jaettu socket)
+                    continue
+                except Exception as e:
+                    # käsitellään muut mahdolliset virheet
+                    access_log.log.error(f"Server error: {e}")
+                    break
+                access_log.log.debug("Client connected from %s", addr)
+
+                # yhteysraja tarkistetaan jo tässä, jotta saman ip:n ylimääräiset yhteydet
+                # eivät vie säikeitä tai paikkoja jonosta muilta clienteilta
+                ip = addr[0]
+                if not connection_limits.acquire(ip):
+                    reject_overloaded(client_socket, "429 Too Many Requests")
+                    continue
+
+                # yhteys laitetaan jonoon, josta vapaa säie ottaa sen käsittelyyn
+                # overload="block": jos jono on täynnä, serveri lakkaa hyväksymästä uusia yhteyksiä,
+                # kunnes jonossa on tilaa (uudet yhteydet odottavat käyttöjärjestelmän backlogissa)
+                # overload="reject": jos jono on täynnä, clientille vastataan 503
+                if overload == "block":
+                    while not pool.submit((client_socket, ip), block=True, timeout=1):
+                        if stop_event.is_set():
+                            client_socket.close()
+                            connection_limits.release(ip)
+                            break
+                elif not pool.submit((client_socket, ip)):
+                    reject_overloaded(client_socket)
+                    connection_limits.release(ip)
+
+    except KeyboardInterrupt:
+        access_log.log.info("# CTRL+C detected. Shutting down. #")
+    finally:
+        # suljetaan vain tämän prosessin tiedostokuvaaja: jos socket on annettu uudelle
+        # prosessille, se kuuntelee edelleen eikä backlogissa odottavia yhteyksiä katkaista
+        server_socket.close()
+        if ready_fd is not None:
+            os.close(ready_fd)
+        # keep-alive-yhteydet, jotka odottavat seuraavaa requestia, suljetaan heti
+        # ja kesken olevat requestit saavat valmistua
+        drain.start()
+        if not pool.shutdown(shutdown_timeout):
+            access_log.log.warning(f"Closing {len(drain)} connections after {shutdown_timeout}s shutdown timeout")
+            drain.close_all()
+            pool.shutdown(1)
+
+
+# IP-osoite, ja porttinumero
+# jota tcp-serveri kuuntelee, annetaan parameterina
+def start_server(host, port, handle_request, workers=WORKERS, queue_size=QUEUE_SIZE, backlog=BACKLOG,
+                 overload="reject", shutdown_timeout=graceful.SHUTDOWN_TIMEOUT, connection_limits=None,
+                 ssl_context=None, upload_limit=None):
+    # SIGHUPin jälkeen käynnistetty prosessi saa kuuntelevan socketin edelliseltä prosessilta
+    server_socket = graceful.inherited_socket()
+    if server_socket is None:
+        server_socket = create_server_socket(host, port, backlog)
+    stop_event = threading.Event()
+    reload_event = threading.Event()
+    graceful.install_signal_handlers(stop_event.set, reload_event.set)
+    scheme = "https" if ssl_context is not None else "http"
+    access_log.log.info(f"Server listening on {scheme}://{host}:{port} (pid {os.getpid()})")
+    graceful.notify_ready()
+    serve_forever(server_socket, handle_request, workers, queue_size, overload,
+                  stop_event, reload_event, shutdown_timeout, connection_limits, ssl_context, upload_limit)
+
+
+def parse_args(host, port):
+    # komentoriviparametrit, esim:
+    # python app.py --mode asyncio --port 8000
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    # threaded: jokaiselle yhteydelle oma säie (thread)
+    # asyncio: kaikki yhteydet käsitellään yhdessä säikeessä asyncion event loopilla
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    # threaded-serverin säikeiden määrä, jonon koko ja listen()-backlog
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--backlog", type=int, default=BACKLOG)
+    # mitä tehdään, kun jono on täynnä: reject = vastataan 503, block = lakataan hyväksymästä yhteyksiä
+    parser.add_argument("--overload", choices=["reject", "block"], default="reject")
+    # prosessien määrä: 1 = yksi prosessi, N > 1 = master-prosessi käynnistää N worker-prosessia
+    parser.add_argument("--processes", type=int, default=1)
+    # kuinka monta sekuntia keskeneräisiä requesteja odotetaan sammutuksessa (SIGTERM, Ctrl+C)
+    parser.add_argument("--shutdown-timeout", type=float, default=graceful.SHUTDOWN_TIMEOUT)
+    # aikarajat ja clienttikohtaiset rajat: --header-timeout, --max-connections-per-ip, --rate-limit...
+    limits.add_arguments(parser)
+    # profilointi (ks. profiler.py): --profile lisää /debug-routet ja SIGUSR1-käsittelijän,
+    # --slow-request 200 kirjoittaa lokiin yli 200 ms kestäneiden requestien vaiheiden kestot
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--slow-request", type=float, default=0, metavar="MS")
+    # HTTPS: --certfile cert.pem --keyfile key.pem (ks. tls.py)
+    tls.add_arguments(parser)
+    # lokitus: --log-level debug näyttää myös yhteyksien avaukset ja sulkemiset
+    parser.add_argument("--log-level", choices=list(access_log.LEVELS), default="info")
+    parser.add_argument("--log-format", choices=["common", "json"], default="common")
+    parser.add_argument("--log-file", default=None)
+    args = parser.parse_args()
+    access_log.configure(args.log_level, args.log_format, args.log_file)
+    profiler.configure(args.slow_request)
+    return args
+
+
+def main(router, handle_request, host, port):
+    # esimerkkiserverien (app.py, teht1_server.py, render_template_example.py) yhteinen __main__:
+    # lukee komentoriviparametrit ja käynnistää threaded-, prefork- tai asyncio-serverin
+    # async_server ja prefork importtaavat tämän moduulin, joten ne importataan vasta täällä
+    import async_server
+    import prefork
+
+    args = parse_args(host, port)
+    # aikarajat ja clienttikohtaiset rajat, ks. limits.py
+    connection_limits = limits.from_args(args)
+    if args.profile:
+        # /debug/profile- ja /debug/slow-routet sekä SIGUSR1, ks. profiler.py
+        profiler.install(router)
+    # --certfile cert.pem --keyfile key.pem: HTTPS (ks. tls.py)
+    # context luodaan ennen prefork-workereita, jotta ne jakavat session ticketien avaimen
+    ssl_context = tls.from_args(args)
+    if args.mode == "asyncio":
+        async_server.start_server(args.host, args.port, handle_request, args.shutdown_timeout, connection_limits,
+                                  ssl_context, router.upload_limit)
+    elif args.processes > 1:
+        # --processes N käynnistää N worker-prosessia, jotta kaikki prosessoriytimet ovat käytössä
+        prefork.start_server(args.host, args.port, handle_request, processes=args.processes,
+                             backlog=args.backlog, workers=args.workers, queue_size=args.queue_size,
+                             overload=args.overload, shutdown_timeout=args.shutdown_timeout,
+                             connection_limits=connection_limits, ssl_context=ssl_context,
+                             upload_limit=router.upload_limit)
+    else:
+        start_server(args.host, args.port, handle_request, workers=args.workers, queue_size=args.queue_size,
+                     backlog=args.backlog, overload=args.overload, shutdown_timeout=args.shutdown_timeout,
+                     connection_limits=connection_limits, ssl_context=ssl_context, upload_limit=router.upload_limit)
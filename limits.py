@@ -0,0 +1,201 @@
+# yhteyksien aikarajat ja clienttikohtaiset rajoitukset
+#
+# pelkkä recv()-timeout ei suojaa hitaalta clientilta: client, joka lähettää headerit tavu kerrallaan
+# (slowloris) tai lukee responsea tavu kerrallaan, saa jokaisella tavulla uuden timeoutin ja varaa
+# threaded-serverissä säikeen niin pitkäksi aikaa kuin haluaa. siksi requestin jokaisella vaiheella
+# on oma aikarajansa, joka lasketaan vaiheen alusta eikä edellisestä recv():stä:
+# - idle_timeout: kuinka kauan odotetaan seuraavan requestin ensimmäistä tavua
+# - header_timeout: kuinka kauan headerien lukeminen saa kestää ensimmäisestä tavusta alkaen
+# - body_timeout: kuinka kauan bodyn lukeminen saa kestää headerien jälkeen
+# - write_timeout: kuinka kauan responsen lähettäminen saa kestää (isot responset saavat lisäaikaa,
+#   ks. WriteDeadline)
+# headerien tai bodyn aikarajan ylittyessä clientille vastataan 408 Request Timeout ja yhteys suljetaan
+#
+# lisäksi yhdeltä IP-osoitteelta
+# - max_connections_per_ip: yhtäaikaisten yhteyksien määrä on rajattu (ylimenevät saavat heti 429)
+#   threaded- ja prefork-serverissä oletuksena neljännes säikeistä, jotta yksi client ei voi varata
+#   niitä kaikkia. asyncio-serverissä yhteys ei varaa säiettä, joten oletuksena rajaa ei ole
+#   (proxyn tai NATin takana kaikki clientit näkyvät samana IP-osoitteena)
+# - rate ja burst: requestien määrä on rajattu token bucketilla: bucketissa on enintään burst tokenia,
+#   jokainen request vie yhden ja tokeneita tulee lisää rate kappaletta sekunnissa
+#   (rate=0 poistaa rajoituksen käytöstä)
+#
+# huom: prefork-serverissä jokaisella worker-prosessilla on omat laskurinsa
+import math
+import socket
+import threading
+import time
+
+import http_server
+import metrics
+
+# kuinka kauan (sekunteina) avoin yhteys saa odottaa seuraavaa requestia
+IDLE_TIMEOUT = 5
+HEADER_TIMEOUT = 10
+BODY_TIMEOUT = 60
+WRITE_TIMEOUT = 30
+# kuinka monta tavua responsesta saa lähettää write_timeoutin aikana, ennen kuin aikarajaa jatketaan
+WRITE_TIMEOUT_BYTES = 1024 * 1024
+# 0 = ei rajaa, threaded-serverin oletus on neljännes http_server.WORKERSista (ks. from_args)
+MAX_CONNECTIONS_PER_IP = 8
+RATE = 0
+BURST = 50
+# kun bucketeja on tätä enemmän, täyteen ehtineet poistetaan, jotta muisti ei kasva rajatta
+MAX_BUCKETS = 10000
+
+
+class Limits:
+    # yksi Limits-olio jaetaan kaikkien saman serverin yhteyksien kesken
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, header_timeout=HEADER_TIMEOUT, body_timeout=BODY_TIMEOUT,
+                 write_timeout=WRITE_TIMEOUT, max_connections_per_ip=MAX_CONNECTIONS_PER_IP, rate=RATE,
+                 burst=BURST):
+        self.idle_timeout = idle_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        self.max_connections_per_ip = max_connections_per_ip
+        self.rate = rate
+        self.burst = max(1, burst)
+        # {ip: avoimien yhteyksien määrä}
+        self._connections = {}
+        # {ip: [tokenit, päivitysaika]}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, ip):
+        # kutsutaan, kun yhteys hyväksytään: palauttaa False, jos ip:llä on jo liikaa yhteyksiä
+        # jokaista onnistunutta acquirea kohden pitää kutsua release
+        with self._lock:
+            count = self._connections.get(ip, 0)
+            if self.max_connections_per_ip and count >= self.max_connections_per_ip:
+                metrics.inc("http_rejected_total", labels=(("reason", "connections"),))
+                return False
+            self._connections[ip] = count + 1
+            return True
+
+    def release(self, ip):
+        with self._lock:
+            count = self._connections.get(ip, 0) - 1
+            if count > 0:
+                self._connections[ip] = count
+            else:
+                self._connections.pop(ip, None)
+
+    def allow(self, ip):
+        # token bucket: palauttaa 0, jos request sallitaan, muuten sekuntimäärän (Retry-After),
+        # jonka päästä ip:llä on taas token
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[ip] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            retry_after = max(1, math.ceil((1 - bucket[0]) / self.rate))
+        metrics.inc("http_rejected_total", labels=(("reason", "rate"),))
+        return retry_after
+
+    def _prune(self, now):
+        # täysi bucket on sama kuin bucket, jota ei ole vielä luotu, joten sen voi poistaa
+        full = [ip for ip, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for ip in full:
+            del self._buckets[ip]
+
+
+class ReadDeadline:
+    # yhden yhteyden lukemisen aikaraja: timeout() kertoo, kuinka kauan seuraavaa recv():tä saa odottaa
+    # headerien ja bodyn aikaraja lasketaan vaiheen alusta, joten hitaasti tippuva data ei pidennä sitä
+
+    def __init__(self, limits):
+        self.limits = limits
+        # "idle", "header" tai "body"
+        self.phase = None
+        self._deadline = None
+
+    def timeout(self, parser):
+        # palauttaa sekunnit (<= 0, jos aikaraja on jo ylittynyt)
+        if parser.idle:
+            self.phase = "idle"
+            return self.limits.idle_timeout
+        now = time.monotonic()
+        phase = "body" if parser.reading_body else "header"
+        if phase != self.phase:
+            self.phase = phase
+            self._deadline = now + (self.limits.body_timeout if phase == "body" else self.limits.header_timeout)
+        return self._deadline - now
+
+    def reset(self):
+        # request on luettu kokonaan, seuraavan requestin aikarajat alkavat alusta
+        self.phase = None
+
+    def expired(self):
+        # aikaraja ylittyi: idle-yhteys suljetaan hiljaa, muuten clientille vastataan 408
+        metrics.inc("http_timeouts_total", labels=(("phase", self.phase or "idle"),))
+        return self.phase in ("header", "body")
+
+
+class WriteDeadline:
+    # yhden responsen lähettämisen aikaraja
+    # socketin timeout koskee yhtä send()-kutsua, ja sendall(), sendfile() ja sendmsg()-silmukka tekevät
+    # niitä monta: jokainen saisi oman timeoutinsa, ja tavu kerrallaan lukeva client voisi varata säikeen
+    # loputtomiin. siksi aikaraja lasketaan lähetyksen alusta ja jokainen kutsu saa vain jäljellä olevan ajan
+    # aikarajaa jatketaan write_timeoutilla jokaista lähetettyä megatavua kohden, jotta isojen tiedostojen
+    # lähettäminen ei katkea, kun client lukee niitä kohtuullista vauhtia
+
+    def __init__(self, write_timeout):
+        self.write_timeout = write_timeout
+        self._started = time.monotonic()
+        self._sent = 0
+
+    def remaining(self):
+        # sekunnit, jotka seuraava lähetys saa odottaa (<= 0, jos aikaraja on ylittynyt)
+        return self._started + self.write_timeout * (1 + self._sent // WRITE_TIMEOUT_BYTES) - time.monotonic()
+
+    def settimeout(self, client_socket):
+        # asettaa socketin timeoutiksi jäljellä olevan ajan, heittää socket.timeoutin, jos aikaa ei ole
+        timeout = self.remaining()
+        if timeout <= 0:
+            raise socket.timeout
+        client_socket.settimeout(timeout)
+
+    def sent(self, size):
+        self._sent += size
+
+
+def too_many_requests(retry_after):
+    return http_server.error_response(429, "Too Many Requests", (("Retry-After", str(retry_after)),))
+
+
+def add_arguments(parser):
+    # komentoriviparametrit http_server.parse_argsiin
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument("--header-timeout", type=float, default=HEADER_TIMEOUT)
+    parser.add_argument("--body-timeout", type=float, default=BODY_TIMEOUT)
+    parser.add_argument("--write-timeout", type=float, default=WRITE_TIMEOUT)
+    parser.add_argument("--max-connections-per-ip", type=int, default=None,
+                        help="0 = no limit (default: --workers // 4 in threaded mode, no limit in asyncio mode)")
+    # requestia sekunnissa per IP-osoite, 0 = ei rajaa
+    parser.add_argument("--rate-limit", type=float, default=RATE)
+    parser.add_argument("--rate-burst", type=int, default=BURST)
+
+
+def from_args(args):
+    max_connections_per_ip = args.max_connections_per_ip
+    if max_connections_per_ip is None and args.mode == "asyncio":
+        max_connections_per_ip = 0
+    elif max_connections_per_ip is None:
+        # threaded-serverissä jokainen yhteys varaa säikeen: jos yhden ip:n raja olisi yhtä suuri
+        # kuin säikeiden määrä, yksi client voisi varata ne kaikki
+        max_connections_per_ip = max(1, args.workers // 4)
+    return Limits(args.idle_timeout, args.header_timeout, args.body_timeout, args.write_timeout,
+                  max_connections_per_ip, args.rate_limit, args.rate_burst)
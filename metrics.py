@@ -0,0 +1,190 @@
+# mittarit (metrics) Prometheus-muodossa, esim. GET /metrics:
+#
+#   http_requests_total{route="/users",method="GET"} 42
+#   http_request_duration_seconds_bucket{route="/users",phase="handler",le="0.001"} 40
+#
+# jokaisella säikeellä on oma "shard", johon se kirjoittaa ilman lukkoja,
+# joten mittaaminen ei hidasta requestien käsittelyä eikä säikeet joudu odottamaan toisiaan
+# /metrics laskee shardien arvot yhteen vasta kun sitä pyydetään
+#
+# huom: prefork-tilassa jokaisella worker-prosessilla on omat mittarinsa
+import bisect
+import threading
+import time
+
+import access_log
+import http_server
+
+# histogrammien rajat sekunteina
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = (("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),)
+
+# method-labelin arvot: client voi lähettää minkä tahansa metodin, ja jokainen uusi arvo
+# loisi uuden aikasarjan, joten muut metodit kirjataan nimellä "other"
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"))
+
+_HELP = {
+    "http_requests_total": ("counter", "Requests by route and method (unlisted methods as other)."),
+    "http_responses_total": ("counter", "Responses by status code."),
+    "http_request_duration_seconds": ("histogram", "Request latency by route and phase (parse, handler, send)."),
+    "http_template_render_seconds": ("histogram", "Template render time by template."),
+    "http_bytes_received_total": ("counter", "Bytes read from clients."),
+    "http_bytes_sent_total": ("counter", "Bytes written to clients."),
+    "http_active_connections": ("gauge", "Open client connections."),
+    "http_timeouts_total": ("counter", "Connections closed by a deadline, by phase (idle, header, body, write)."),
+    "http_rejected_total": ("counter", "Connections or requests refused by per-client limits, by reason."),
+    "http_threads": ("gauge", "Threads in the server process."),
+    "tls_handshakes_total": ("counter", "Completed TLS handshakes, by whether the session was resumed."),
+    "tls_handshake_errors_total": ("counter", "TLS handshakes that failed or timed out."),
+    "log_records_dropped_total": ("counter", "Log records dropped because the log queue was full."),
+}
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        # {(nimi, labelit): arvo}
+        self.counters = {}
+        # {(nimi, labelit): [määrä per bucket..., +Inf, summa]}
+        self.histograms = {}
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _Shard()
+        _local.shard = shard
+        # lukko tarvitaan vain kerran säiettä kohden
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def inc(name, value=1, labels=()):
+    # kasvattaa laskuria (counter) tai muuttaa mittaria (gauge, value voi olla negatiivinen)
+    # labels on tuple: (("route", "/users"), ("method", "GET"))
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, labels=()):
+    # lisää havainnon histogrammiin (esim. kesto sekunteina)
+    histograms = _shard().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+    histogram[bisect.bisect_left(BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+def record_request(route, method, status, parse, handler, send, sent):
+    # kirjaa yhden käsitellyn requestin mittarit
+    shard = _shard()
+    counters = shard.counters
+    if route == "-":
+        # tuntematon polku (404): method-label jätetään pois, ettei skannaus kasvata mittareita
+        key = ("http_requests_total", (("route", route),))
+    else:
+        key = ("http_requests_total", (("route", route), ("method", method if method in METHODS else "other")))
+    counters[key] = counters.get(key, 0) + 1
+    key = ("http_responses_total", (("status", str(status)),))
+    counters[key] = counters.get(key, 0) + 1
+    key = ("http_bytes_sent_total", ())
+    counters[key] = counters.get(key, 0) + sent
+    observe("http_request_duration_seconds", parse, (("route", route), ("phase", "parse")))
+    observe("http_request_duration_seconds", handler, (("route", route), ("phase", "handler")))
+    observe("http_request_duration_seconds", send, (("route", route), ("phase", "send")))
+
+
+def timed_chunks(name, chunks, labels=()):
+    # mittaa, kauanko generaattorin palojen tuottaminen kestää yhteensä
+    # (esim. StreamingResponsen templaatin renderöinti, joka tapahtuu lähetyksen aikana)
+    elapsed = 0.0
+    iterator = iter(chunks)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield chunk
+    finally:
+        observe(name, elapsed, labels)
+
+
+def _format_labels(labels, extra=()):
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render():
+    # palauttaa kaikki mittarit Prometheuksen tekstimuodossa
+    counters = {}
+    histograms = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        # dict.copy() on atominen, joten toinen säie voi kirjoittaa shardiin samaan aikaan
+        for key, value in shard.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, histogram in shard.histograms.copy().items():
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    total[i] += value
+
+    # säikeiden määrä ja pudotetut lokirivit luetaan vasta pyydettäessä
+    counters[("http_threads", ())] = threading.active_count()
+    counters[("log_records_dropped_total", ())] = access_log.log.dropped
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = _HELP.get(name, ("counter", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    histogram_names = {}
+    for (name, labels), histogram in histograms.items():
+        histogram_names.setdefault(name, []).append((labels, histogram))
+    for name in sorted(histogram_names):
+        kind, help_text = _HELP.get(name, ("histogram", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, histogram in sorted(histogram_names[name], key=lambda item: item[0]):
+            # Prometheuksen bucketit ovat kumulatiivisia: le="0.01" sisältää myös alle 0.005 kestäneet
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', repr(bound)),))} {cumulative}")
+            cumulative += histogram[len(BUCKETS)]
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def handler(request):
+    # router-funktio: router.get("/metrics")(metrics.handler)
+    return http_server.Response(render(), headers=CONTENT_TYPE)
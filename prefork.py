@@ -0,0 +1,183 @@
+# pre-fork-serveri
+#
+# pythonin GIL (global interpreter lock) sallii vain yhden säikeen suorittaa python-koodia kerrallaan,
+# joten threaded-serveri käyttää vain yhtä prosessoriydintä, vaikka säikeitä olisi monta
+# siksi master-prosessi käynnistää (fork) useamman worker-prosessin, joista jokainen
+# hyväksyy ja käsittelee yhteyksiä omilla säikeillään
+#
+# master avaa kuuntelevan socketin ja workerit perivät sen forkissa: kaikki workerit odottavat
+# samaa socketia ja yhteyden hyväksyy se, joka ehtii ensin
+# (SO_REUSEPORTilla jokaisella workerilla olisi oma socketinsa ja oma backlogjononsa, ja kun worker
+# lopettaa ja sulkee socketinsa, kernel katkaisee kaikki sen jonossa vielä odottavat yhteydet.
+# jaettu socket pysyy auki niin kauan kuin master on käynnissä, joten workereita voi vaihtaa
+# ilman, että yhtään yhteyttä katkeaa)
+#
+# master käynnistää kaatuneen workerin uudelleen ja välittää SIGTERM-signaalin workereille,
+# jotka lakkaavat hyväksymästä uusia yhteyksiä ja käsittelevät jo hyväksytyt loppuun
+# (jos workerit eivät ole lopettaneet shutdown_timeoutin jälkeen, ne tapetaan SIGKILLillä)
+#
+# jos worker kaatuu heti käynnistyttyään (esim. tietokanta puuttuu), uusi worker kaatuisi samalla
+# tavalla: siksi uudelleenkäynnistystä odotetaan sitä pidempään, mitä useammin workerit ovat
+# peräkkäin kaatuneet alle MIN_UPTIMEn sisällä (0.5 s, 1 s, 2 s, ... enintään MAX_RESPAWN_DELAY).
+# kun jokainen worker on kaatunut näin MAX_FAST_FAILURES kertaa, master lopettaa exit-koodilla 1
+#
+# SIGHUP masterille käynnistää workerit uudelleen yksi kerrallaan: ensin uusi worker
+# ja vasta sitten vanhalle SIGTERM, joten yhteyksiä hyväksytään koko ajan
+# huom: uudet workerit forkataan masterista, joten ne lukevat templatet ja muut tiedostot
+# uudestaan, mutta python-koodi on sama kuin masterin käynnistyessä
+import os
+import signal
+import threading
+import time
+
+import access_log
+import graceful
+import http_server
+
+# worker, joka lopettaa tätä nopeammin (sekunteina), lasketaan kaatuneeksi käynnistyksessä
+MIN_UPTIME = 5
+RESPAWN_DELAY = 0.5
+MAX_RESPAWN_DELAY = 30
+MAX_FAST_FAILURES = 5
+
+
+def _run_worker(host, port, handle_request, server_socket, options):
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    # Ctrl+C lähettää SIGINTin kaikille prosesseille, master hoitaa sammutuksen
+    # (samoin SIGHUPin, joka tulee esim. terminaalin sulkemisesta)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # jaetussa socketissa useampi worker voi herätä samasta yhteydestä,
+    # joten accept() ei saa jäädä odottamaan
+    server_socket.setblocking(False)
+
+    access_log.log.info(f"Worker {os.getpid()} listening on {host}:{port}")
+    http_server.serve_forever(server_socket, handle_request, stop_event=stop_event, **options)
+
+
+def _spawn(host, port, handle_request, server_socket, options):
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            _run_worker(host, port, handle_request, server_socket, options)
+        except Exception as e:
+            access_log.log.error(f"Worker error: {e}")
+            exit_code = 1
+        finally:
+            # os._exit ei aja atexit-funktioita, joten loki kirjoitetaan loppuun ennen sitä
+            access_log.log.close()
+            # os._exit, jotta lapsiprosessi ei palaa masterin koodiin
+            os._exit(exit_code)
+    return pid
+
+
+def _terminate(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def start_server(host, port, handle_request, processes=os.cpu_count(), backlog=http_server.BACKLOG,
+                 shutdown_timeout=graceful.SHUTDOWN_TIMEOUT, **options):
+    # options välitetään http_server.serve_foreverille (workers, queue_size, overload, connection_limits,
+    # ssl_context, upload_limit)
+    options["shutdown_timeout"] = shutdown_timeout
+    server_socket = http_server.create_server_socket(host, port, backlog)
+
+    stopping = False
+    reloading = False
+
+    def stop():
+        nonlocal stopping
+        stopping = True
+
+    def reload():
+        nonlocal reloading
+        reloading = True
+
+    graceful.install_signal_handlers(stop, reload)
+
+    # {pid: käynnistysaika}
+    children = {}
+    # SIGHUPissa sammutetut vanhat workerit
+    retired = set()
+    # peräkkäin heti käynnistyksen jälkeen kaatuneet workerit ja odottavien uudelleenkäynnistysten ajat
+    failures = 0
+    respawns = []
+    failed = False
+    for _ in range(processes):
+        children[_spawn(host, port, handle_request, server_socket, options)] = time.monotonic()
+    access_log.log.info(f"Master {os.getpid()} started {processes} workers on {host}:{port}")
+
+    while not stopping:
+        if reloading:
+            reloading = False
+            access_log.log.info("# Restarting workers. #")
+            # uusi worker käynnistetään ennen kuin vanha lopettaa, joten yhteyksiä hyväksytään koko ajan
+            # vanhat workerit siirretään retirediin, jotta niitä ei käynnistetä uudelleen
+            for pid in list(children):
+                del children[pid]
+                retired.add(pid)
+                children[_spawn(host, port, handle_request, server_socket, options)] = time.monotonic()
+                _terminate(pid)
+        now = time.monotonic()
+        while respawns and respawns[0] <= now:
+            respawns.pop(0)
+            children[_spawn(host, port, handle_request, server_socket, options)] = now
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            # kaikki workerit ovat kaatuneet, mutta uudelleenkäynnistyksiä vielä odotetaan
+            if not respawns:
+                break
+            pid = 0
+        if pid == 0:
+            # yksikään worker ei ole lopettanut, tarkistetaan hetken päästä uudestaan
+            time.sleep(0.5)
+            continue
+        retired.discard(pid)
+        started = children.pop(pid, None)
+        if started is not None and not stopping:
+            if time.monotonic() - started < MIN_UPTIME:
+                failures += 1
+            else:
+                failures = 0
+            if failures >= MAX_FAST_FAILURES * processes:
+                access_log.log.error(f"Workers keep exiting right after starting ({failures} times), stopping")
+                failed = True
+                break
+            # viive kasvaa kaksinkertaiseksi joka kerta, kun jokainen worker on kaatunut kerran
+            delay = min(RESPAWN_DELAY * 2 ** (failures // processes), MAX_RESPAWN_DELAY) if failures else 0
+            access_log.log.warning(f"Worker {pid} exited with status {status}, restarting in {delay:g} s")
+            respawns.append(time.monotonic() + delay)
+            respawns.sort()
+
+    access_log.log.info("# Shutting down workers. #")
+    for pid in children:
+        _terminate(pid)
+    # odotetaan myös SIGHUPissa sammutettuja vanhoja workereita
+    children = set(children) | retired
+    # workerit saavat shutdown_timeoutin verran aikaa käsitellä requestit loppuun
+    deadline = time.monotonic() + shutdown_timeout + 5
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if time.monotonic() > deadline:
+                access_log.log.warning("Workers did not stop in time, killing them")
+                for pid in children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                deadline = float("inf")
+            time.sleep(0.1)
+    server_socket.close()
+    if failed:
+        raise SystemExit(1)
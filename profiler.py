@@ -0,0 +1,194 @@
+# profilointi: mihin serverin aika kuluu?
+#
+# 1) sampling profiler: erillinen säie ottaa INTERVAL sekunnin välein kuvan jokaisen säikeen
+#    kutsupinosta (sys._current_frames()) ja laskee, kuinka monta kertaa kukin pino nähtiin.
+#    mitä useammin funktio on pinossa, sitä enemmän aikaa siinä kuluu. tulos on "collapsed stack"
+#    -muodossa, josta saa flamegraphin (esim. flamegraph.pl tai speedscope.app):
+#      worker-3;http_server.py:handle_connection;app.py:index 42
+#
+#    käynnistys ja pysäytys (serveri käynnistetty --profile-parametrilla):
+#      curl -X POST localhost:8080/debug/profile/start
+#      curl -X POST localhost:8080/debug/profile/stop > profile.folded
+#    tai signaalilla: kill -USR1 <pid> käynnistää, toinen kill -USR1 pysäyttää ja kirjoittaa
+#    tuloksen tiedostoon profile-<pid>-<aika>.folded
+#
+# 2) hitaiden requestien loki (--slow-request 200 = yli 200 ms kestäneet): lokiin kirjoitetaan
+#    requestin vaiheiden kestot (parse, handler, compress, send) ja handlerin sisällä mitatut
+#    osat (templatet, SQL-kyselyt). viimeisimmät näkyvät myös osoitteessa GET /debug/slow
+#
+# kun profiler ei ole käynnissä ja --slow-request puuttuu, hinta on yksi if-lause per request
+import collections
+import contextvars
+import os
+import signal
+import sys
+import threading
+import time
+
+import access_log
+import http_server
+
+INTERVAL = 0.01
+# kuinka monta hidasta requestia /debug/slow muistaa
+SLOW_REQUESTS = 100
+TEXT = (("Content-Type", "text/plain; charset=utf-8"),)
+
+# sekunteina, 0 = hitaiden requestien lokitus ei ole käytössä
+slow_request = 0
+_slow = collections.deque(maxlen=SLOW_REQUESTS)
+# requestin aikana mitatut osat: ContextVar eikä threading.local, koska asyncio-serverissä
+# samassa säikeessä käsitellään monta requestia vuorotellen ja jokaisella taskilla on oma contextinsa
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+class Sampler:
+    def __init__(self):
+        self.counts = {}
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        # RLock: signaalikäsittelijä (toggle) voi keskeyttää pääsäikeen, jolla lukko on jo
+        self._lock = threading.RLock()
+        # {code-olio: "tiedosto.py:funktio"}, ettei samaa merkkijonoa muodosteta joka kerta
+        self._labels = {}
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=INTERVAL):
+        # palauttaa False, jos profiler on jo käynnissä
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.counts = {}
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="profiler", daemon=True)
+            self._thread.start()
+        access_log.log.info(f"Profiler started ({interval * 1000:g} ms interval)")
+        return True
+
+    def stop(self):
+        # pysäyttää profilerin ja palauttaa tuloksen
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            access_log.log.info(f"Profiler stopped after {self.samples} samples")
+        return self.collapsed()
+
+    def _run(self, interval):
+        own = threading.get_ident()
+        labels = self._labels
+        counts = self.counts
+        while not self._stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                key = ";".join(stack)
+                counts[key] = counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        # "säie;uloin;...;sisin määrä" rivi per pino, yleisin ensin
+        items = sorted(list(self.counts.items()), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+
+sampler = Sampler()
+
+
+def toggle(signum=None, frame=None):
+    # signaalikäsittelijä: käynnistää profilerin tai pysäyttää sen ja kirjoittaa tuloksen tiedostoon
+    if not sampler.running:
+        sampler.start()
+        return
+    path = f"profile-{os.getpid()}-{int(time.time())}.folded"
+    with open(path, "w") as f:
+        f.write(sampler.stop())
+    access_log.log.info(f"Profile written to {path}")
+
+
+def configure(slow_request_ms=0):
+    global slow_request
+    slow_request = slow_request_ms / 1000
+
+
+def begin():
+    # requestin käsittely alkaa: handlerin sisällä mitatut osat kerätään tähän listaan
+    if slow_request:
+        _spans.set([])
+
+
+def record(name, seconds):
+    # esim. record("template posts.html", 0.012), ei tee mitään, jos lokitus ei ole käytössä
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def finish(method, path, status, total, phases):
+    # kutsutaan jokaisen requestin lopuksi, kun slow_request on käytössä
+    # phases: (("parse", 0.001), ("handler", 0.2), ...)
+    spans = _spans.get()
+    _spans.set(None)
+    if total < slow_request:
+        return
+    details = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in phases)
+    if spans:
+        details += " [" + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in spans) + "]"
+    line = f"{method} {path} {status} {total * 1000:.1f} ms: {details}"
+    _slow.append(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}")
+    access_log.log.warning(f"Slow request {line}")
+
+
+def slow_handler(request):
+    # GET /debug/slow: viimeisimmät hitaat requestit, uusin ensin
+    return http_server.Response("".join(f"{line}\n" for line in reversed(_slow)), headers=TEXT)
+
+
+def profile_handler(request):
+    # GET /debug/profile: tähänastinen tulos pysäyttämättä profileria
+    return http_server.Response(sampler.collapsed(), headers=TEXT)
+
+
+def start_handler(request):
+    # POST /debug/profile/start?interval=0.005
+    try:
+        interval = float(request.query.get("interval", [INTERVAL])[0])
+    except ValueError:
+        return http_server.error_response(400, "Bad Request")
+    if not 0.001 <= interval <= 1:
+        return http_server.error_response(400, "Bad Request")
+    if not sampler.start(interval):
+        return http_server.error_response(409, "Profiler Already Running")
+    return http_server.Response("started\n", headers=TEXT)
+
+
+def stop_handler(request):
+    # POST /debug/profile/stop: pysäyttää profilerin ja palauttaa tuloksen
+    return http_server.Response(sampler.stop(), headers=TEXT)
+
+
+def install(router, prefix="/debug"):
+    # lisää profiloinnin routet routeriin ja SIGUSR1-käsittelijän (vain pääsäikeessä)
+    # routet antavat tietoa serverin sisäisestä toiminnasta, joten ne lisätään vain --profile-parametrilla
+    router.get(f"{prefix}/profile")(profile_handler)
+    router.post(f"{prefix}/profile/start")(start_handler)
+    router.post(f"{prefix}/profile/stop")(stop_handler)
+    router.get(f"{prefix}/slow")(slow_handler)
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, toggle)
@@ -0,0 +1,203 @@
+# valmiiden responsejen välimuisti
+#
+# harvoin muuttuvan sivun (esim. /users) response tallennetaan muistiin valmiiksi
+# tavuiksi muutettuna (http_server.Response), jolloin seuraavalla kerralla sitä ei tarvitse
+# renderöidä eikä muuttaa tavuiksi, vaan se lähetetään sellaisenaan
+# (vain status line ja headerit muodostetaan lähetettäessä, jotta Date-header on ajan tasalla)
+#
+# responseen lisätään ETag (bodyn tiiviste) ja Last-Modified (milloin response luotiin)
+# jos clientilla on sama versio jo välimuistissaan, se lähettää
+# If-None-Match- tai If-Modified-Since-headerin ja serveri vastaa lyhyesti 304 Not Modified
+#
+# pakatut versiot (gzip, br) luodaan vain kerran ja tallennetaan pakkaamattoman rinnalle
+#
+# käyttö:
+#
+#   cache = ResponseCache()
+#
+#   @router.get("/users")
+#   @cache.cached(ttl=10)
+#   def users(request):
+#       ...
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+import compression
+import http_server
+
+
+class _Entry:
+    # variants: {pakkausmuoto: (Response, 304-Response, ETag)}
+    # pakkaamaton versio on avaimella None, pakatut luodaan vasta kun niitä pyydetään
+    __slots__ = ("status", "headers", "body", "compressible", "etag", "last_modified", "expires", "variants",
+                 "size", "stored")
+
+    def __init__(self, status, headers, body, compressible, etag, last_modified, expires):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.compressible = compressible
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.variants = {}
+        self.size = 0
+        # onko entry välimuistissa (vai liian iso tallennettavaksi tai jo poistettu)
+        self.stored = False
+
+
+def _is_not_modified(etag, last_modified, headers):
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-None-Match voi sisältää useamman ETagin pilkulla erotettuna tai *
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class ResponseCache:
+    def __init__(self, ttl=60, max_entries=256, max_bytes=16 * 1024 * 1024):
+        # ttl: kuinka monta sekuntia responsea käytetään ennen kuin se luodaan uudestaan
+        # max_entries ja max_bytes rajoittavat muistin käyttöä,
+        # vähiten aikaa sitten käytetty response poistetaan ensin (LRU)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response, ttl=None):
+        # response on http_server.Response tai handle_requestin tyylinen merkkijono
+        # "status line\r\nheaderit\r\n\r\nbody"
+        response = http_server.as_response(response)
+        body = response.body
+        compressible = (compression.is_compressible(response.header("Content-Type"))
+                        and len(body) >= compression.MIN_SIZE)
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        entry = _Entry(response.status, response.headers, body, compressible, etag, int(time.time()),
+                       time.monotonic() + (self.ttl if ttl is None else ttl))
+        variant = self._build_variant(entry, None)
+        entry.variants[None] = variant
+        entry.size = len(variant[0].body)
+        if entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            entry.stored = True
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def _build_variant(self, entry, encoding):
+        body = entry.body if encoding is None else compression.compress(entry.body, encoding)
+        etag = compression.variant_etag(entry.etag, encoding)
+        validators = (("ETag", etag), ("Last-Modified", formatdate(entry.last_modified, usegmt=True)))
+        if entry.compressible:
+            validators += (compression.VARY,)
+        content_encoding = (("Content-Encoding", encoding),) if encoding is not None else ()
+        response = http_server.Response(body, entry.status, entry.headers + validators + content_encoding)
+        not_modified = http_server.Response(b"", 304, validators)
+        return response, not_modified, etag
+
+    def variant(self, entry, encoding):
+        # pakattu versio luodaan ensimmäisellä kerralla ja tallennetaan entryyn
+        variant = entry.variants.get(encoding)
+        if variant is not None:
+            return variant
+        # pakataan lukon ulkopuolella, jotta muut säikeet eivät joudu odottamaan
+        variant = self._build_variant(entry, encoding)
+        with self._lock:
+            existing = entry.variants.get(encoding)
+            if existing is not None:
+                return existing
+            entry.variants[encoding] = variant
+            entry.size += len(variant[0].body)
+            if entry.stored:
+                self._size += len(variant[0].body)
+                self._evict()
+        return variant
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        entry.stored = False
+        self._size -= entry.size
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.stored = False
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
+
+    def cached(self, ttl=None):
+        # dekoraattori router-funktioille
+        # välimuistin avain on metodi ja path query stringeineen
+        # vain 200 OK -responset tallennetaan
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(request, **params):
+                key = (request.method, request.path)
+                entry = self.get(key)
+                if entry is None:
+                    response = handler(request, **params)
+                    # vain kokonaisina tavuina olevat (Response tai merkkijono) 200-responset tallennetaan
+                    if isinstance(response, str):
+                        response = http_server.as_response(response)
+                    if not isinstance(response, http_server.Response) or response.status != 200:
+                        return response
+                    entry = self.put(key, response, ttl)
+                    with self._lock:
+                        self.misses += 1
+                else:
+                    with self._lock:
+                        self.hits += 1
+
+                encoding = None
+                if entry.compressible:
+                    encoding = compression.negotiate(request.headers.get("Accept-Encoding"))
+                response, not_modified, etag = self.variant(entry, encoding)
+                if _is_not_modified(etag, entry.last_modified, request.headers):
+                    return not_modified
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,190 @@
+# reititin (router): päättelee metodista ja pathista, mikä funktio käsittelee requestin
+#
+# aiemmin handle_request oli pitkä if-elif-ketju (if method == "GET": if path == "/users": ...),
+# jossa jokainen request kävi läpi kaikki ehdot järjestyksessä
+# routerissa
+# - kiinteät pathit (esim. /users) löytyvät suoraan dictionarysta
+# - parametrilliset pathit (esim. /users/<int:user_id>) etsitään puusta (trie),
+#   jossa jokainen taso vastaa yhtä path-osaa: /users/5 -> "users" -> "5"
+#
+# käyttö:
+#
+#   router = Router()
+#
+#   @router.get("/users/<int:user_id>")
+#   def get_user(request, user_id):
+#       ...
+#
+#   # tiedostojen lähetys (multipart/form-data) on sallittu vain routeille, joille se on erikseen sallittu
+#   @router.post("/upload", max_upload_size=http_parser.MAX_UPLOAD_SIZE)
+#   def upload(request):
+#       ...
+import forms
+import http_parser
+import http_server
+import static_files
+
+
+def path_converter(value):
+    return value
+
+
+# parametrityypit: <int:user_id> muuttaa path-osan kokonaisluvuksi
+# <path:filename> ottaa loput pathista kauttaviivoineen (esim. css/style.css)
+CONVERTERS = {
+    "str": str,
+    "int": int,
+    "path": path_converter,
+}
+
+
+class _Node:
+    __slots__ = ("children", "params", "handlers", "route")
+
+    def __init__(self):
+        # kiinteät path-osat: {"users": _Node}
+        self.children = {}
+        # parametrit: [(nimi, muunnosfunktio, _Node)]
+        self.params = []
+        # {metodi: funktio}, jos tähän solmuun päättyy route
+        self.handlers = None
+        # route sellaisenaan, esim. "/users/<int:user_id>" (mittareita varten)
+        self.route = None
+
+
+def _parse_segment(segment):
+    # "<int:user_id>" -> ("user_id", int), "users" -> None
+    if segment.startswith("<") and segment.endswith(">"):
+        converter, _, name = segment[1:-1].rpartition(":")
+        return name, CONVERTERS[converter or "str"]
+    return None
+
+
+class Router:
+    def __init__(self):
+        # kiinteät pathit: {"/users": {"GET": funktio}}
+        self.static_routes = {}
+        self.root = _Node()
+        # {(metodi, route): multipart-bodyn maksimikoko}
+        self.upload_sizes = {}
+
+    def add_route(self, method, path, handler):
+        segments = path.strip("/").split("/") if path != "/" else []
+        if not any(_parse_segment(segment) for segment in segments):
+            self.static_routes.setdefault(path, {})[method] = handler
+            return
+
+        node = self.root
+        for segment in segments:
+            param = _parse_segment(segment)
+            if param is None:
+                node = node.children.setdefault(segment, _Node())
+                continue
+            name, converter = param
+            for existing_name, existing_converter, child in node.params:
+                if existing_name == name and existing_converter is converter:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, converter, child))
+                node = child
+        if node.handlers is None:
+            node.handlers = {}
+            node.route = path
+        node.handlers[method] = handler
+
+    def route(self, path, methods=("GET",), max_upload_size=0):
+        # dekoraattori, joka rekisteröi funktion käsittelemään pathin annetuilla metodeilla
+        # max_upload_size: route ottaa vastaan tiedostoja (multipart/form-data) tähän kokoon asti
+        def decorator(handler):
+            for method in methods:
+                self.add_route(method, path, handler)
+                if max_upload_size:
+                    self.upload_sizes[(method, path)] = max_upload_size
+            return handler
+        return decorator
+
+    def get(self, path):
+        return self.route(path, ("GET",))
+
+    def post(self, path, max_upload_size=0):
+        return self.route(path, ("POST",), max_upload_size)
+
+    def static(self, prefix, directory):
+        # lähettää tiedostoja hakemistosta, esim. router.static("/static", "./static")
+        # /static/style.css -> ./static/style.css
+        self.add_route("GET", prefix.rstrip("/") + "/<path:filename>", static_files.directory_handler(directory))
+
+    def _match(self, node, segments, index, params):
+        # palauttaa solmun, johon path päättyy, tai None
+        if index == len(segments):
+            return node if node.handlers is not None else None
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._match(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        for name, converter, child in node.params:
+            if converter is path_converter:
+                if child.handlers is not None:
+                    params[name] = "/".join(segments[index:])
+                    return child
+                continue
+            try:
+                value = converter(segment)
+            except ValueError:
+                continue
+            params[name] = value
+            found = self._match(child, segments, index + 1, params)
+            if found is not None:
+                return found
+            del params[name]
+        return None
+
+    def _lookup(self, path):
+        # palauttaa ({metodi: funktio}, parametrit, route) tai (None, {}, None), jos pathia ei löydy
+        handlers = self.static_routes.get(path)
+        if handlers is not None:
+            return handlers, {}, path
+        params = {}
+        segments = path.strip("/").split("/") if path != "/" else []
+        node = self._match(self.root, segments, 0, params)
+        if node is None:
+            return None, {}, None
+        return node.handlers, params, node.route
+
+    def upload_limit(self, method, path):
+        # multipart-bodyn maksimikoko, 0 = route ei ota vastaan tiedostoja (tai sitä ei ole)
+        # annetaan serverille, joka välittää sen http_parser.RequestParserille
+        if not self.upload_sizes:
+            return 0
+        handlers, _, route = self._lookup(path.partition("?")[0])
+        if handlers is None or method not in handlers:
+            return 0
+        return self.upload_sizes.get((method, route), 0)
+
+    def resolve(self, path):
+        # palauttaa ({metodi: funktio}, parametrit) tai (None, {}), jos pathia ei löydy
+        handlers, params, _ = self._lookup(path)
+        return handlers, params
+
+    def dispatch(self, method, path, headers, request):
+        # query string (?after=10&limit=20) erotetaan pathista ja parsitaan dictionaryksi
+        # {"after": ["10"], "limit": ["20"]}
+        path, _, query_string = path.partition("?")
+        request.query = forms.parse_qs(query_string) if query_string else {}
+
+        handlers, params, route = self._lookup(path)
+        if handlers is None:
+            return http_server.error_response(404, "Not Found")
+        # mittareissa käytetään routea eikä pathia, jotta /users/1, /users/2, ...
+        # eivät kaikki tule omiksi riveikseen
+        request.route = route
+        handler = handlers.get(method)
+        if handler is None:
+            # path löytyy, mutta ei tällä metodilla: 405 Method Not Allowed
+            # Allow-header kertoo, mitkä metodit ovat sallittuja
+            return http_server.error_response(405, "Method Not Allowed", (("Allow", ", ".join(sorted(handlers))),))
+        return handler(request, **params)
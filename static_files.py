@@ -0,0 +1,118 @@
+# staattisten tiedostojen (css, kuvat, html) lähettäminen
+#
+# tiedostoa ei lueta python-merkkijonoksi, vaan socket.sendfile() pyytää käyttöjärjestelmää
+# kopioimaan tiedoston sisällön suoraan socketiin (zero-copy), joten isotkaan tiedostot
+# eivät kulje pythonin muistin kautta
+#
+# Range-headerilla client voi pyytää vain osan tiedostosta (esim. keskeytyneen latauksen jatkaminen):
+#   Range: bytes=0-99     -> tavut 0-99
+#   Range: bytes=100-     -> tavusta 100 loppuun
+#   Range: bytes=-100     -> viimeiset 100 tavua
+import mimetypes
+import os
+import stat
+from email.utils import formatdate
+from urllib.parse import unquote
+
+import compression
+import http_server
+
+
+def _parse_range(range_header, size):
+    # palauttaa (alku, loppu) tai None, jos headeria ei voi käyttää (jolloin lähetetään koko tiedosto)
+    # heittää ValueErrorin, jos pyydetty alue on tiedoston ulkopuolella (416)
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        # useampaa aluetta samassa requestissa ei tueta
+        return None
+    start, sep, end = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else size - 1
+        else:
+            # bytes=-100 tarkoittaa viimeisiä 100 tavua
+            suffix = int(end)
+            if suffix <= 0:
+                raise ValueError("empty suffix range")
+            start = max(0, size - suffix)
+            end = size - 1
+    except ValueError:
+        raise ValueError(f"invalid range {range_header}")
+    if start >= size or start > end:
+        raise ValueError(f"range {range_header} not satisfiable")
+    return start, min(end, size - 1)
+
+
+def resolve_path(directory, filename):
+    # estää pääsyn hakemiston ulkopuolelle (path traversal), esim. /static/../../etc/passwd
+    # realpath purkaa ..-osat ja symboliset linkit, jonka jälkeen tarkistetaan,
+    # että tulos on yhä hakemiston sisällä
+    if "\0" in filename:
+        return None
+    root = os.path.realpath(directory)
+    full_path = os.path.realpath(os.path.join(root, filename))
+    if not full_path.startswith(root + os.sep):
+        return None
+    return full_path
+
+
+def serve_file(request, directory, filename):
+    # pathissa erikoismerkit ovat %-koodattuja, esim. välilyönti on %20
+    full_path = resolve_path(directory, unquote(filename))
+    if full_path is None:
+        return http_server.error_response(404, "Not Found")
+    try:
+        f = open(full_path, "rb")
+    except OSError:
+        return http_server.error_response(404, "Not Found")
+
+    try:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            f.close()
+            return http_server.error_response(404, "Not Found")
+
+        size = st.st_size
+        etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+        validators = (("ETag", etag), ("Last-Modified", formatdate(st.st_mtime, usegmt=True)))
+        # pakatun version ETag on muotoa "...-gzip" (ks. compression.variant_etag)
+        if compression.strip_variant(request.headers.get("If-None-Match", "")) == etag:
+            f.close()
+            return http_server.Response(b"", 304, validators)
+
+        content_type, _ = mimetypes.guess_type(full_path)
+        content_type = content_type or "application/octet-stream"
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+
+        status = 200
+        offset, count = 0, size
+        headers = (("Content-Type", content_type), ("Accept-Ranges", "bytes")) + validators
+        range_header = request.headers.get("Range")
+        if range_header:
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                f.close()
+                return http_server.error_response(416, "Range Not Satisfiable", (("Content-Range", f"bytes */{size}"),))
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                offset, count = start, end - start + 1
+                headers += (("Content-Range", f"bytes {start}-{end}/{size}"),)
+
+        # Content-Length (count) saadaan suoraan stat()-kutsusta, tiedostoa ei tarvitse lukea
+        return http_server.FileResponse(f, offset, count, status, headers)
+    except Exception:
+        f.close()
+        raise
+
+
+def directory_handler(directory):
+    # palauttaa router-funktion, joka lähettää tiedostoja hakemistosta
+    def handler(request, filename):
+        return serve_file(request, directory, filename)
+    return handler
@@ -0,0 +1,254 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import profiler
+import template_engine
+
+_EXTENDS_RE = re.compile(r'\s*{%\s*extends\s+["\']([^"\']+)["\']\s*%}')
+_INCLUDE_RE = re.compile(r'{%\s*include\s+["\']([^"\']+)["\']\s*%}')
+_BLOCK_RE = re.compile(r'{%\s*block\s+(\w+)\s*%}|{%\s*endblock(?:\s+\w+)?\s*%}')
+
+
+class _Entry:
+    # dependencies: {path: (mtime_ns, size)} of every file the flattened
+    # template was built from, including the template itself
+    __slots__ = ("template", "dependencies", "checked_at")
+
+    def __init__(self, template, dependencies, checked_at):
+        self.template = template
+        self.dependencies = dependencies
+        self.checked_at = checked_at
+
+
+def _parse_blocks(source):
+    # Parses block tags into a tree: a list of text strings and
+    # (name, children) tuples.
+    root = []
+    stack = []
+    current = root
+    pos = 0
+    for match in _BLOCK_RE.finditer(source):
+        if match.start() > pos:
+            current.append(source[pos:match.start()])
+        pos = match.end()
+        if match.group(1) is not None:
+            children = []
+            current.append((match.group(1), children))
+            stack.append((current, match.group(0)))
+            current = children
+        else:
+            if not stack:
+                raise template_engine.TemplateSyntaxError("endblock without a matching block")
+            current, _ = stack.pop()
+    if stack:
+        raise template_engine.TemplateSyntaxError(f"unclosed block: {stack[-1][1]}")
+    if pos < len(source):
+        current.append(source[pos:])
+    return root
+
+
+def _collect_blocks(tree, blocks):
+    # {name: children} for every block in the tree, outermost first
+    for node in tree:
+        if isinstance(node, tuple):
+            name, children = node
+            blocks.setdefault(name, children)
+            _collect_blocks(children, blocks)
+    return blocks
+
+
+def _join_blocks(tree, overrides=None, keep_tags=True):
+    # Turns a block tree back into source. Blocks found in overrides are
+    # replaced by the child template's version.
+    out = []
+    for node in tree:
+        if isinstance(node, str):
+            out.append(node)
+            continue
+        name, children = node
+        if overrides is not None and name in overrides:
+            children = overrides[name]
+        body = _join_blocks(children, overrides, keep_tags)
+        out.append(f"{{% block {name} %}}{body}{{% endblock %}}" if keep_tags else body)
+    return "".join(out)
+
+
+class TemplateLoader:
+    """
+    Loads templates from disk and keeps the compiled versions in memory.
+
+    {% extends "base.html" %}, {% block name %} and {% include "part.html" %}
+    are resolved when a template is loaded: the layout, the child's blocks and
+    the included files are flattened into one source string and compiled
+    once. Paths are relative to the directory of the referring template.
+
+    Cached templates are revalidated against the mtime and size of every file
+    they were built from at most once per check_interval seconds, so in
+    between a lookup costs no syscalls. When a file changes, every cached
+    template built from it is dropped, so editing a base layout invalidates
+    all of its children. At most max_entries templates are kept; the least
+    recently used one is evicted first.
+
+    Args:
+        check_interval: Seconds between stat() calls for a cached template.
+            0 revalidates on every lookup, None never revalidates.
+        max_entries: Maximum number of compiled templates kept in memory.
+    """
+
+    def __init__(self, check_interval=1.0, max_entries=128):
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # {file path: set of cached template paths built from it}
+        self._dependents = {}
+        self._lock = threading.Lock()
+
+    def get_template(self, path):
+        """
+        Returns the compiled template for path, loading it if needed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if self.check_interval is None or now - entry.checked_at < self.check_interval:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return entry.template
+
+        if entry is not None:
+            changed = [dependency for dependency, version in entry.dependencies.items()
+                       if _version(dependency) != version]
+            if not changed:
+                with self._lock:
+                    entry.checked_at = now
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                return entry.template
+            with self._lock:
+                for dependency in changed:
+                    self._invalidate_dependents(dependency)
+
+        dependencies = {}
+        source = self._resolve(path, dependencies, ())
+        template = template_engine.compile_template(_join_blocks(_parse_blocks(source), keep_tags=False))
+
+        with self._lock:
+            self.misses += 1
+            self._remove(path)
+            self._entries[path] = _Entry(template, dependencies, now)
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(path)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return template
+
+    def _resolve(self, path, dependencies, parents):
+        # Returns the source of path with includes and extends resolved.
+        # Block tags are kept so that a template further down the extends
+        # chain can still override them.
+        key = os.path.normpath(path)
+        if key in parents:
+            raise template_engine.TemplateSyntaxError(
+                f"circular extends/include: {' -> '.join(parents + (key,))}")
+        parents += (key,)
+        # stat before reading, so a write in between is caught on the next check
+        dependencies[key] = _version(key)
+        with open(key, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        directory = os.path.dirname(key)
+        source = _INCLUDE_RE.sub(
+            lambda match: _join_blocks(_parse_blocks(
+                self._resolve(os.path.join(directory, match.group(1)), dependencies, parents)), keep_tags=False),
+            source)
+
+        extends = _EXTENDS_RE.match(source)
+        if extends is None:
+            return source
+        # everything in the child outside its blocks is ignored
+        overrides = _collect_blocks(_parse_blocks(source[extends.end():]), {})
+        layout = self._resolve(os.path.join(directory, extends.group(1)), dependencies, parents)
+        return _join_blocks(_parse_blocks(layout), overrides)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        for dependency in entry.dependencies:
+            dependents = self._dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(path)
+                if not dependents:
+                    del self._dependents[dependency]
+
+    def _invalidate_dependents(self, dependency):
+        for path in list(self._dependents.get(dependency, ())):
+            self._remove(path)
+
+    def render(self, path, data=None):
+        template = self.get_template(path)
+        started = time.perf_counter()
+        result = template.render(data or {})
+        elapsed = time.perf_counter() - started
+        metrics.observe("http_template_render_seconds", elapsed, (("template", path),))
+        profiler.record(f"template {path}", elapsed)
+        return result
+
+    def render_bytes(self, path, data=None):
+        template = self.get_template(path)
+        started = time.perf_counter()
+        result = template.render_bytes(data or {})
+        elapsed = time.perf_counter() - started
+        metrics.observe("http_template_render_seconds", elapsed, (("template", path),))
+        profiler.record(f"template {path}", elapsed)
+        return result
+
+    def generate(self, path, data=None, chunk_size=8192):
+        # Chunks are rendered lazily while the response is sent, so the
+        # render time is the total time spent producing them.
+        return metrics.timed_chunks("http_template_render_seconds",
+                                    self.get_template(path).generate(data or {}, chunk_size),
+                                    (("template", path),))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def _version(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+default_loader = TemplateLoader()
+
+
+def get_template(path):
+    return default_loader.get_template(path)
+
+
+def render(path, data=None):
+    return default_loader.render(path, data)
+
+
+def render_bytes(path, data=None):
+    return default_loader.render_bytes(path, data)
+
+
+def generate(path, data=None, chunk_size=8192):
+    return default_loader.generate(path, data, chunk_size)
@@ -0,0 +1,92 @@
+# HTTPS (TLS) suoraan serverissä ilman erillistä proxya
+#
+# TLS-kättely (handshake) vie kaksi edestakaista matkaa ja paljon prosessoriaikaa (avaintenvaihto),
+# joten se tehdään worker-säikeessä eikä accept-luupissa: hidas tai jumittunut client ei estä
+# muiden yhteyksien hyväksymistä. kättelyllä on aikaraja (header_timeout, ks. limits.py)
+#
+# palaava client voi jatkaa edellistä istuntoa (session resumption) ilman täyttä kättelyä:
+# - session ticket: serveri antaa clientille salatun istunnon, jonka client lähettää takaisin
+# - session cache: serveri muistaa istunnot (TLS 1.2, session id)
+# ticketien avain luodaan, kun SSLContext luodaan, joten context luodaan ennen prefork-workerien
+# käynnistämistä: kaikki workerit jakavat saman avaimen ja client voi jatkaa istuntoa missä tahansa
+# workerissa
+#
+# ALPN: client ja serveri sopivat kättelyssä protokollasta, serveri tukee vain http/1.1:tä
+#
+# itse allekirjoitettu sertifikaatti paikalliseen testaukseen:
+#   openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 365 -subj "/CN=localhost"
+#   python app.py --certfile cert.pem --keyfile key.pem
+#   curl -k https://localhost:8080/
+import ssl
+
+import access_log
+import metrics
+
+ALPN_PROTOCOLS = ["http/1.1"]
+# kuinka monta session ticketiä TLS 1.3 -client saa jokaisessa kättelyssä
+NUM_TICKETS = 2
+
+
+def create_context(certfile, keyfile=None, ciphers=None, ecdh_curve=None, tickets=True):
+    # ciphers: OpenSSL:n cipher-lista TLS 1.2:lle, esim. "ECDHE+AESGCM:ECDHE+CHACHA20"
+    # (TLS 1.3:n cipherit ovat aina OpenSSL:n oletukset)
+    # ecdh_curve: avaintenvaihdon käyrä, esim. "prime256v1" (oletuksena OpenSSL valitsee itse)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.set_alpn_protocols(ALPN_PROTOCOLS)
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if ecdh_curve:
+        context.set_ecdh_curve(ecdh_curve)
+    # clientin cipher-järjestyksen sijaan käytetään serverin järjestystä
+    context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    if tickets:
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = NUM_TICKETS
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    return context
+
+
+def handshake(context, client_socket, timeout):
+    # tekee kättelyn (threaded-serverin worker-säikeessä)
+    # palauttaa SSLSocketin tai None, jos kättely epäonnistui (socket on silloin suljettu)
+    client_socket.settimeout(timeout)
+    try:
+        ssl_socket = context.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
+    except OSError:
+        client_socket.close()
+        return None
+    try:
+        ssl_socket.do_handshake()
+    except OSError as e:
+        # ssl.SSLError ja socket.timeout ovat OSErrorin alaluokkia
+        metrics.inc("tls_handshake_errors_total")
+        access_log.log.debug(f"TLS handshake failed: {e}")
+        ssl_socket.close()
+        return None
+    record_handshake(ssl_socket)
+    return ssl_socket
+
+
+def record_handshake(ssl_object):
+    # ssl_object on SSLSocket tai (asyncio) SSLObject
+    metrics.inc("tls_handshakes_total", labels=(("resumed", "true" if ssl_object.session_reused else "false"),))
+
+
+def add_arguments(parser):
+    # komentoriviparametrit http_server.parse_argsiin, --certfile ottaa HTTPS:n käyttöön
+    parser.add_argument("--certfile", default=None)
+    parser.add_argument("--keyfile", default=None)
+    parser.add_argument("--ciphers", default=None)
+    parser.add_argument("--ecdh-curve", default=None)
+    parser.add_argument("--no-session-tickets", dest="session_tickets", action="store_false")
+
+
+def from_args(args):
+    # palauttaa SSLContextin tai None, jos --certfile puuttuu
+    if not args.certfile:
+        return None
+    return create_context(args.certfile, args.keyfile, args.ciphers, args.ecdh_curve, args.session_tickets)